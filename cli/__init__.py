@@ -16,6 +16,11 @@ def cli(verbose):
 from . import (
     calculate_extension_infor,
     calculate_SoN,
-    find_summits
+    find_summits,
+    query_SoN,
+    run_mcool,
+    run_pipeline,
+    screen_summits,
+    sweep_SoN
 )
 
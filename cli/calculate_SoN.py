@@ -1,11 +1,18 @@
 import bioframe
 import logging
+import itertools
+import contextlib
 import glob
 import click
 import os
 
+from multiprocessing import Pool
+
 from cli import cli
+from lib.band_matrix import *
+from lib.checkpoint import *
 from lib.signal_over_noise import *
+from lib.son_store import save_son_store
 from lib.util import *
 
 
@@ -76,6 +83,17 @@ logger = logging.getLogger(__name__)
     show_default = True,
     type = bool
 )
+@click.option(
+    "--track_format",
+    help = "Format of SoN tracks, can be given multiple times. "
+    "'bigwig' writes SoN_<resolution>.bw with zoom levels directly from "
+    "the scores (requires pyBigWig), 'store' writes SoN_<resolution>.npz "
+    "for random access by query-son",
+    multiple = True,
+    default = ('bedgraph',),
+    show_default = True,
+    type = click.Choice(['bedgraph', 'bigwig', 'store'])
+)
 @click.option(
     "--use_mean",
     help = "Use mean for SoN score calculation in pixels from sampling regions else median",
@@ -88,12 +106,62 @@ logger = logging.getLogger(__name__)
     help = "file containing chromsize",
     type = str
 )
+@click.option(
+    "--tile_size",
+    help = "Length (bp) of the tiles each chromosome is split into, "
+    "only the tile and its flanks are loaded at once. "
+    "0 means the whole chromosome",
+    default = 0,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--max_memory",
+    help = "Approximate peak memory (MB) of each process, "
+    "the tiles are shrunk to fit in it. 0 means unlimited",
+    default = 0,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--processes",
+    help = "Number of processes, chromosomes are scheduled "
+    "onto the processes from the largest one",
+    default = 1,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--cache_dir",
+    help = "Directory of the on-disk cache of balanced matrices, "
+    "shared with find-fountains. Default is no cache",
+    default = None,
+    type = str
+)
+@click.option(
+    "--cache_size",
+    help = "Maximum size (MB) of the cache, the least recently "
+    "used matrices are evicted. 0 means unlimited",
+    default = 0,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--checkpoint_dir",
+    help = "Directory of per-chromosome checkpoints of SoN, a rerun only "
+    "calculates the chromosomes whose parameters or cooler changed, "
+    "instead of skipping existing tracks. Default is no checkpoint",
+    default = None,
+    type = str
+)
 
 
 def calculate_SoN_score(
     cool_path, out_dir, chromsize_path, norm=False,
     coverage_ratio=0.2, ext_length=500000, padding_width=2,
-    offset=20000, integrate=True, use_mean=False
+    offset=20000, integrate=True, use_mean=False, tile_size=0,
+    max_memory=0, processes=1, cache_dir=None, cache_size=0,
+    track_format=('bedgraph',), checkpoint_dir=None
 ):
     """
     Calculate signal-over-noise (SoN) score for a specific chromosome.
@@ -107,24 +175,108 @@ def calculate_SoN_score(
     chromsize = bioframe.read_chromsizes(chromsize_path, natsort=True)
     out_dir_path = _create_output_directory(out_dir, resolution)
 
-    for chrom in clr.chromnames:
-
-        logger.info(f'Processing chromosome {chrom}...')
-
-        # calculate SoN score
-        SoN_track = _calculate_SoN_score(
-            clr, chrom, norm, ext_length, padding_width,
-            offset, coverage_ratio, use_mean, chromsize, out_dir_path, resolution
-        )
+    chroms, restored, keys = [], [], {}
+    for chrom in _schedule_chromosomes(clr):
+
+        if checkpoint_dir is not None:
+            keys[chrom] = _SoN_checkpoint_key(
+                clr, chrom, norm, coverage_ratio, ext_length,
+                padding_width, offset, use_mean
+            )
+            SoN_score = load_checkpoint(checkpoint_dir, 'SoN', chrom, keys[chrom])
+
+            if SoN_score is not None:
+                logger.info(f'SoN of chromosome {chrom} restored from checkpoint')
+                restored.append((chrom, 0, SoN_score))
+            else:
+                chroms.append(chrom)
+
+        # Check if SoN track already exists, the other formats are written at once
+        elif set(track_format) == {'bedgraph'} and \
+                os.path.exists(_SoN_track_path(out_dir_path, chrom, resolution)):
+            logger.info(f'SoN track for chromosome {chrom} already exists. Skipping...')
+        else:
+            chroms.append(chrom)
+
+    tile_bins = _get_tile_bins(
+        tile_size, max_memory, resolution, ext_length, padding_width, offset
+    )
 
-        # output tracks
-        _write_SoN_tracks(
-            out_dir_path, chrom, resolution, SoN_track
+    # matrices are never sent to the workers, each of them
+    # loads the band of its tile from the cooler (or the cache)
+    tasks = [
+        (cool_path, chrom, bin_start, bin_end, norm, ext_length, padding_width,
+         offset, coverage_ratio, use_mean, resolution, cache_dir, cache_size)
+        for chrom, bin_start, bin_end in _split_tiles(clr, chroms, tile_bins)
+    ]
+    n_tiles = {chrom: 0 for chrom in chroms}
+    for task in tasks:
+        n_tiles[task[1]] += 1
+
+    # restored chromosomes are written as a single tile
+    n_tiles.update({chrom: 1 for chrom, _, _ in restored})
+
+    with _worker_pool(processes) as pool:
+        pool_map = pool.map if pool is not None else map
+
+        # tiles of a chromosome share its cached band, build it once
+        if cache_dir is not None and tile_bins is not None:
+            list(pool_map(_cache_band_worker, [
+                (cool_path, chrom, norm, ext_length, cache_dir, cache_size)
+                for chrom in chroms
+            ]))
+
+        if pool is not None:
+            results = pool.imap_unordered(_calculate_SoN_worker, tasks)
+        else:
+            results = map(_calculate_SoN_worker, tasks)
+
+        SoN_tracks = {}
+        if 'bigwig' in track_format:
+            bigwig = BigWigWriter(
+                os.path.join(out_dir_path, f'SoN_{resolution}.bw'),
+                chromsize[['chr' + chrom for chrom in clr.chromnames]]
+            )
+
+        # stitch the tiles, tracks are written as soon as chromosomes complete
+        tiles = {chrom: {} for chrom in n_tiles}
+        for chrom, bin_start, SoN_score in itertools.chain(restored, results):
+            tiles[chrom][bin_start] = SoN_score
+
+            if len(tiles[chrom]) == n_tiles[chrom]:
+                chrom_tiles = tiles.pop(chrom)
+                SoN_score = np.concatenate(
+                    [chrom_tiles[i] for i in sorted(chrom_tiles)]
+                )
+
+                if checkpoint_dir is not None and chrom in chroms:
+                    save_checkpoint(checkpoint_dir, 'SoN', chrom, keys[chrom], SoN_score)
+                SoN_track = _make_SoN_track(chrom, SoN_score, resolution, chromsize)
+
+                # output tracks
+                if 'bedgraph' in track_format:
+                    _write_SoN_tracks(
+                        out_dir_path, chrom, resolution, SoN_track
+                    )
+                if 'bigwig' in track_format:
+                    bigwig.add_track('chr' + chrom, SoN_track)
+                if 'store' in track_format:
+                    SoN_tracks['chr' + chrom] = SoN_track['value'].values
+
+    if 'bigwig' in track_format:
+        bigwig.close()
+        logger.info(f'SoN track written to {out_dir_path}/SoN_{resolution}.bw')
+
+    if 'store' in track_format:
+        save_son_store(
+            os.path.join(out_dir_path, f'SoN_{resolution}.npz'), SoN_tracks,
+            resolution, chromsize[['chr' + chrom for chrom in clr.chromnames]]
         )
+        logger.info(f'SoN store written to {out_dir_path}/SoN_{resolution}.npz')
 
     logger.info('SoN score calculation completed.')
 
-    if integrate:
+    if integrate and 'bedgraph' in track_format:
         logger.info('Merging all chromosome tracks into one file...')
         _merge_bedgraph_files(out_dir_path, resolution)
 
@@ -162,33 +314,181 @@ def _create_output_directory(out_dir, resolution):
     return out_dir_path
 
 
-def _calculate_SoN_score(clr, chrom, norm, ext_length, padding_width, offset, coverage_ratio, use_mean, chromsize, out_dir_path, resolution):
+def _worker_pool(processes):
     """
-    Calculate signal-over-noise (SoN) score for a specific chromosome.
+    Pool of worker processes, to be used as a context manager.
+
+    Args:
+        processes (int): Number of processes.
+
+    Returns:
+        A Pool, or a null context giving None for a single process.
+    """
+    return Pool(processes) if processes > 1 else contextlib.nullcontext()
+
+
+def _schedule_chromosomes(clr):
+    """
+    Order chromosomes from the largest to the smallest one.
+
+    Args:
+        clr (Cooler): Cooler object.
+
+    Returns:
+        List of chromosome names.
+    """
+    chromsizes = clr.chromsizes.sort_values(ascending=False, kind='stable')
+    return list(chromsizes.index)
+
+
+def _get_tile_bins(tile_size, max_memory, resolution, ext_length, padding_width, offset):
+    """
+    Determine the number of bins per tile.
+
+    Args:
+        tile_size (int): Length of tiles (bp), 0 for whole chromosomes.
+        max_memory (int): Approximate peak memory (MB), 0 for unlimited.
+
+    Returns:
+        Number of bins per tile, None for whole chromosomes.
+    """
+    tile_bins = tile_size // resolution if tile_size > 0 else None
+
+    if max_memory > 0:
+        n_diags = band_width(ext_length, resolution)
+        n_layers = n_diags - ((offset // resolution) * 2 + 1 if offset != 0 else 0)
+        shift = 2 * padding_width + 1
+        halo = shift + padding_width + ext_length // resolution
 
+        # band, its prefix sums and the layer-sum matrix
+        bytes_per_bin = 32 * n_diags + 16 * n_layers
+        fixed_bytes = 64 * n_diags * halo + 32 * n_layers * shift
+        memory_bins = (max_memory * 1024 ** 2 - fixed_bytes) // bytes_per_bin
+
+        if memory_bins < 1:
+            raise ValueError(
+                f'max_memory {max_memory}MB is too small for ext_length {ext_length}'
+            )
+
+        tile_bins = memory_bins if tile_bins is None else min(tile_bins, memory_bins)
+
+    if tile_bins is not None and tile_bins < 1:
+        raise ValueError('The tile size should not be smaller than resolution')
+
+    return tile_bins
+
+
+def _split_tiles(clr, chroms, tile_bins):
     """
+    Split chromosomes into tiles of bins.
 
-    # Check if SoN track already exists
-    output_path = os.path.join(out_dir_path, f'chr{chrom}_{resolution}_SoN.bedgraph')
-    if os.path.exists(output_path):
-        logger.info(f'SoN track for chromosome {chrom} already exists. Skipping...')
+    Args:
+        clr (Cooler): Cooler object.
+        chroms (list): Chromosome names.
+        tile_bins (int): Number of bins per tile, None for whole chromosomes.
+
+    Returns:
+        List of (chromosome, first bin, last bin + 1) of tiles.
+    """
+    tiles = []
+    for chrom in chroms:
+        n_bins = n_chrom_bins(clr, chrom)
+        step = n_bins if tile_bins is None else tile_bins
+
+        for bin_start in range(0, n_bins, max(step, 1)):
+            tiles.append((chrom, bin_start, min(bin_start + step, n_bins)))
+
+    return tiles
 
-        return None
 
-    mat = clr.matrix(balance=norm).fetch(chrom)
-    SoN_score = calculate_signal_noise_ratio_score(
+def _calculate_SoN_worker(args):
+    """
+    Calculate SoN scores of one tile in a worker process.
+
+    Args:
+        args (tuple): Path to the cooler file followed by
+            the arguments of _calculate_SoN_score.
+
+    Returns:
+        Chromosome name, first bin of the tile and its SoN scores.
+    """
+    cool_path, chrom, bin_start, bin_end = args[:4]
+    logger.info(f'Processing chromosome {chrom} (bins {bin_start}-{bin_end})...')
+
+    clr = cooler.Cooler(cool_path)
+    SoN_score = _calculate_SoN_score(clr, *args[1:])
+
+    return chrom, bin_start, SoN_score
+
+
+def _cache_band_worker(args):
+    """
+    Store the balanced band of a chromosome in the cache.
+
+    Args:
+        args (tuple): Path to the cooler file, chromosome name, normalization,
+            extension length, cache directory and cache size.
+    """
+    cool_path, chrom, norm, ext_length, cache_dir, cache_size = args
+    logger.info(f'Caching balanced matrix of chromosome {chrom}...')
+
+    clr = cooler.Cooler(cool_path)
+    fetch_band(
+        clr, chrom, norm, ext_length,
+        cache_dir=cache_dir, cache_size=cache_size
+    )
+
+
+def _SoN_checkpoint_key(clr, chrom, norm, coverage_ratio, ext_length, padding_width, offset, use_mean):
+    """
+    Checkpoint key of the SoN scores of a chromosome.
+
+    """
+    return checkpoint_key(
+        clr, 'SoN', chrom, norm=norm, coverage_ratio=coverage_ratio,
+        ext_length=ext_length, padding_width=padding_width,
+        offset=offset, use_mean=use_mean
+    )
+
+
+def _calculate_SoN_score(clr, chrom, bin_start, bin_end, norm, ext_length, padding_width, offset, coverage_ratio, use_mean, resolution, cache_dir=None, cache_size=0):
+    """
+    Calculate signal-over-noise (SoN) score for bins [bin_start, bin_end) of a chromosome.
+
+    """
+
+    # only the band touched by sampling boxes is loaded
+    bin_range = plumb_bin_range(
+        bin_start - 2 * padding_width - 1, bin_end + 2 * padding_width + 1,
+        padding_width, ext_length, resolution, n_chrom_bins(clr, chrom)
+    )
+    mat = fetch_band(
+        clr, chrom, norm, ext_length, bin_range,
+        cache_dir=cache_dir, cache_size=cache_size
+    )
+
+    SoN_score = calculate_signal_noise_ratio_track(
         mat=mat, extension_length=ext_length,
         resolution=resolution, half_width=padding_width,
-        offset=offset, coverage_ratio=coverage_ratio, use_mean=use_mean
+        offset=offset, coverage_ratio=coverage_ratio, use_mean=use_mean,
+        bin_start=bin_start, bin_end=bin_end
     )
 
+    return SoN_score
+
+
+def _make_SoN_track(chrom, SoN_score, resolution, chromsize):
+    """
+    Build the SoN track of a chromosome with genomic coordinates.
+
+    """
+
     # Handle NaN or infinite values
-    SoN_score = np.asarray(list(SoN_score))
     SoN_score = np.nan_to_num(SoN_score, nan = 0, posinf=0, neginf=0)
 
     # Get genomic coordinates
-    chr_cord_start = [i * clr.binsize for i in range(len(SoN_score))]
-    chr_cord_end = [(i + 1) * clr.binsize for i in range(len(SoN_score))]
+    chr_cord_start = [i * resolution for i in range(len(SoN_score))]
+    chr_cord_end = [(i + 1) * resolution for i in range(len(SoN_score))]
     data_dict = {
         'chr': np.repeat('chr' + chrom, len(chr_cord_start)),
         'start': chr_cord_start,
@@ -199,6 +499,15 @@ def _calculate_SoN_score(clr, chrom, norm, ext_length, padding_width, offset, co
     SoN_track = align_track_with_chromsize(pd.DataFrame(data_dict), chromsize)
     return SoN_track
 
+
+def _SoN_track_path(out_dir, chrom, resolution):
+    """
+    Path of the SoN track of a chromosome.
+
+    """
+    return os.path.join(out_dir, f'chr{chrom}_{resolution}_SoN.bedgraph')
+
+
 def _write_SoN_tracks(out_dir, chrom, resolution, SoN_track):
     """
     Write SoN tracks to a bedgraph file.
@@ -209,7 +518,7 @@ def _write_SoN_tracks(out_dir, chrom, resolution, SoN_track):
         resolution (int): Resolution of the cooler file.
         SoN_track (DataFrame): Dataframe containing SoN scores and genomic coordinates.
     """
-    output_path = os.path.join(out_dir, f'chr{chrom}_{resolution}_SoN.bedgraph')
+    output_path = _SoN_track_path(out_dir, chrom, resolution)
 
     if SoN_track is not None:
 
@@ -221,7 +530,7 @@ def _write_SoN_tracks(out_dir, chrom, resolution, SoN_track):
 
 def _merge_bedgraph_files(out_dir, resolution):
     """
-    Merge all .bedgraph files into one.
+    Merge the .bedgraph files of the chromosomes into one.
 
     Args:
         out_dir (str): The directory where the .bedgraph files are stored.
@@ -230,8 +539,9 @@ def _merge_bedgraph_files(out_dir, resolution):
     merged_file_name = f'SoN_{resolution}_merged.bedgraph'
     merged_file_path = os.path.join(out_dir, merged_file_name)
 
-    # Find all bedgraph files in the output directory
-    bedgraph_files = glob.glob(os.path.join(out_dir, '*.bedgraph'))
+    # Find the bedgraph files of the chromosomes, not the merged file
+    # left by a previous run
+    bedgraph_files = glob.glob(os.path.join(out_dir, f'chr*_{resolution}_SoN.bedgraph'))
 
     # Read all bedgraph files and concatenate them
     df_list = [
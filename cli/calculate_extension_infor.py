@@ -1,6 +1,8 @@
 import bioframe
 import cooler
 import click
+import hashlib
+import os
 import pandas as pd
 from lib.fountain_extension import *
 from lib.generate_summits import *
@@ -8,11 +10,60 @@ from lib.merge_fountains import *
 from lib.quality_filter import *
 from lib.trans_to_bedpe import *
 from lib.ks_test import *
+from lib.fountain_table import (
+    load_fountain_attrs, load_fountain_dataframe, save_fountain_table
+)
+from lib.checkpoint import checkpoint_key
 from cli import cli
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# filtering options, shared by find-fountains and refilter
+_FILTER_OPTIONS = [
+    click.option(
+        "--p_value",
+        help = "The threshold of p-value for K-S test, can be given multiple "
+        "times to write the fountains of each threshold",
+        multiple=True,
+        default=(0.05,),
+        show_default=True,
+        type = float
+    ),
+    click.option(
+        "--signal_noise_background",
+        help = "The threshold of SoN(fold change) for fountains",
+        nargs=5,
+        default=(1.1, 1.2, 1.3, 1.4, 1.5),
+        show_default=True,
+        type = float
+    ),
+    click.option(
+        "--max_merge_distance",
+        help = "The maximum length we use to merge two close fountains",
+        default=50000,
+        show_default=True,
+        type = int
+    ),
+    click.option(
+        "--output_format",
+        help = "Format of fountain tables, 'npz' writes a columnar binary "
+        "bundle with the dominance profiles as a 2-D array",
+        default = 'tab',
+        show_default = True,
+        type = click.Choice(['tab', 'npz'])
+    ),
+]
+
+def _filter_options(func):
+    """
+    Apply the filtering options to a command.
+
+    """
+    for option in reversed(_FILTER_OPTIONS):
+        func = option(func)
+    return func
+
 @cli.command()
 @click.argument(
     "cool_path", metavar='COOL_PATH',
@@ -82,35 +133,38 @@ logger = logging.getLogger(__name__)
     help = "The absolute file path of output results",
     type = str
 )
+@_filter_options
 @click.option(
-    "--p_value",
-    help = "The threshold of p-value for K-S test",
-    default=0.05,
-    show_default=True,
-    type = float
+    "--cache_dir",
+    help = "Directory of the on-disk cache of balanced matrices, "
+    "shared with calculate-son-score. Default is no cache",
+    default = None,
+    type = str
 )
 @click.option(
-    "--signal_noise_background",
-    help = "The threshold of SoN(fold change) for fountains",
-    nargs=5,
-    default=1.0,
-    show_default=True,
-    type = float
+    "--cache_size",
+    help = "Maximum size (MB) of the cache, the least recently "
+    "used matrices are evicted. 0 means unlimited",
+    default = 0,
+    show_default = True,
+    type = int
 )
 @click.option(
-    "--max_merge_distance",
-    help = "The maximum length we use to merge two close fountains",
-    default=50000,
-    show_default=True,
-    type = int
+    "--checkpoint_dir",
+    help = "Directory of per-chromosome checkpoints, a rerun only evaluates "
+    "the chromosomes whose summits, parameters or cooler changed. "
+    "Default is no checkpoint",
+    default = None,
+    type = str
 )
 
 def find_fountains(
     cool_path, half_width, ext_length,
     region_path, extension_pixels, offset,
     interval_length, coverage_ratio, output, norm=False,
-    p_value = 0.05, signal_noise_background = 1.0,
-    max_merge_distance = 20000,
+    p_value = (0.05,), signal_noise_background = (1.1, 1.2, 1.3, 1.4, 1.5),
+    max_merge_distance = 20000, output_format = 'tab',
+    cache_dir = None, cache_size = 0, checkpoint_dir = None
 ):
     """
     Find fountains based on identified summits.
@@ -133,44 +187,181 @@ def find_fountains(
         extension_pixels[0], extension_pixels[1], extension_pixels[2]
     )
 
-    # Perform plumb calculation, get length and fold change of fountains
-    logger.info('Calculate length of fountains and SoN (fold change)...')
-    df = plumb(
-        clr, half_width = half_width, extension_length=ext_length,
-        norm=norm, regions=region, bin_array=bin_array, offset=offset,
-        interval_length=interval_length, coverage_ratio = coverage_ratio
+    # the evaluation does not depend on the thresholds of the filter,
+    # it is reused when only them change
+    params = dict(
+        regions=_hash_regions(region), half_width=half_width,
+        ext_length=ext_length, norm=norm, extension_pixels=extension_pixels,
+        offset=offset, interval_length=interval_length,
+        coverage_ratio=coverage_ratio
     )
+    key = checkpoint_key(clr, 'evaluation', 'all', **params)
+    df = _load_evaluation(_evaluation_path(output), key)
 
-    df = calculate_fountain_SoN(
-        clr, df, norm=norm,
-        half_width = half_width,
-        coverage_ratio=coverage_ratio,
-        offset = offset
+    if df is not None:
+        logger.info(f'Reuse the evaluation of summits in {_evaluation_path(output)}')
+    else:
+        # Perform plumb calculation, get length and fold change of fountains,
+        # and K-S test in a single pass over the sampling boxes
+        logger.info('Calculate length of fountains, SoN (fold change) and K-S test...')
+        df = evaluate_summits(
+            clr, regions=region, half_width=half_width, extension_length=ext_length,
+            norm=norm, bin_array=bin_array, offset=offset,
+            interval_length=interval_length, coverage_ratio=coverage_ratio,
+            cache_dir=cache_dir, cache_size=cache_size, checkpoint_dir=checkpoint_dir
+        )
+
+        df = sort_by_chrom(df)
+        _save_evaluation(df, output, resolution, key, **params)
+
+    _write_fountains(
+        df, output, resolution, p_value,
+        signal_noise_background, max_merge_distance, output_format
     )
 
-    # Perform K-S test
-    logger.info('Perform K-S test...')
-    df = make_ks_test(
-        clr, regions=df, half_width = half_width,
-        coverage_ratio=coverage_ratio, norm=norm,
-        offset = offset
+    logger.info('Complete!')
+
+
+@cli.command()
+@click.argument(
+    "evaluation_path", metavar='EVALUATION_PATH',
+    type=str, nargs=1
+)
+@click.option(
+    "--output",
+    help = "Prefix of output results, default is the prefix of "
+    "<prefix>_evaluation.npz",
+    default = None,
+    type = str
+)
+@_filter_options
+
+def refilter(
+    evaluation_path, output=None, p_value=(0.05,),
+    signal_noise_background=(1.1, 1.2, 1.3, 1.4, 1.5),
+    max_merge_distance=50000, output_format='tab'
+):
+    """
+    Filter and merge fountains again from the evaluation of summits
+    written by find-fountains or run, with other thresholds.
+
+    """
+    df = load_fountain_dataframe(evaluation_path)
+    attrs = load_fountain_attrs(evaluation_path)
+
+    if output is None:
+        output = evaluation_path[:-len(EVALUATION_SUFFIX)]
+
+    _write_fountains(
+        df, output, attrs['resolution'], p_value,
+        signal_noise_background, max_merge_distance, output_format
     )
 
+    logger.info('Complete!')
+
+
+# the unfiltered evaluation of summits is written to <output>_evaluation.npz
+EVALUATION_SUFFIX = '_evaluation.npz'
+
+def _evaluation_path(output):
+    """
+    Path of the unfiltered evaluation of summits.
+
+    """
+    return output + EVALUATION_SUFFIX
+
+
+def _hash_regions(region):
+    """
+    Content hash of the coordinates of summits.
+
+    """
+    hashes = pd.util.hash_pandas_object(region[['chrom', 'start', 'end']], index=False)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+
+def _save_evaluation(df, output, resolution, key=None, **params):
+    """
+    Write the unfiltered evaluation of summits, for refilter.
+
+    Args:
+        df (DataFrame): Summits evaluated by evaluate_summits.
+        output (str): Prefix of output files.
+        key (str): Key of the cooler, summits and parameters of the
+            evaluation, None if the table is not reused by find-fountains.
+        params: Parameters of the evaluation, stored with the table.
+    """
+    attrs = dict(resolution=resolution, **params)
+    if key is not None:
+        attrs['key'] = key
+
+    # renamed atomically, an interrupted run never leaves a partial table;
+    # the dominance profiles are kept in float64 as in the .tab tables
+    path = _evaluation_path(output)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        save_fountain_table(f, df, dtype=np.float64, attrs=attrs)
+    os.replace(tmp_path, path)
+
+
+def _load_evaluation(path, key):
+    """
+    Load the evaluation of summits, None if absent or of another key.
+
+    """
+    if not os.path.exists(path):
+        return None
+
+    if load_fountain_attrs(path).get('key') != key:
+        return None
+
+    return load_fountain_dataframe(path)
+
+
+def _write_fountains(df, output, resolution, p_value, signal_noise_background, max_merge_distance, output_format='tab'):
+    """
+    Filter and merge evaluated summits, and write fountains
+    for every pair of thresholds of p-value and SoN.
+
+    Args:
+        df (DataFrame): Summits evaluated by evaluate_summits.
+        output (str): Prefix of output files, followed by _p<p-value>
+            when several p-values are given.
+        p_value (list): Thresholds of p-value.
+        signal_noise_background (list): Thresholds of SoN (fold change).
+        output_format (str): 'tab' or 'npz', see save_fountain_table.
+    """
     # Filter based on extension, p-value, and signal noise
     logger.info('Perform filter...')
-    ext_bool = filter_extension(df)
-    pvalue_bool = df['p_value'] < p_value
+    ext_bool = np.asarray(filter_extension(df), dtype=bool)
 
-    for val in signal_noise_background:
+    # the fountains of stricter thresholds are subsets of the loosest ones
+    df = df[
+        ext_bool & (df['p_value'] < max(p_value)) &
+        (df['signal_noise_average_background'] > min(signal_noise_background))
+    ].reset_index(drop=True)
+    bedpe = dataframe_to_bedpe(df, resolution=resolution)
 
-        signal_bool = df['signal_noise_average_background'] > val
-        df_tmp = df[(ext_bool & pvalue_bool & signal_bool)]
-        df_tmp = merge_fountains(df_tmp.reset_index(drop=True), max_distance=max_merge_distance)
-        output_tmp1 = f"{output}_{val}.tab"
-        df_tmp.to_csv(output_tmp1, header=True, index=None, sep='\t')
+    # threshold matrix, one column per threshold
+    pvalue_bool = df['p_value'].values[:, None] < np.asarray(p_value)
+    signal_bool = df['signal_noise_average_background'].values[:, None] > \
+        np.asarray(signal_noise_background)
 
-        output_tmp2 = f"{output}_{val}.bedpe"
-        bedpe = dataframe_to_bedpe(df_tmp, resolution=resolution)
-        bedpe.to_csv(output_tmp2, header=True, index=None, sep='\t')
+    for i, p in enumerate(p_value):
+        prefix = output if len(p_value) == 1 else f"{output}_p{p}"
 
-    logger.info('Complete!')
+        for j, val in enumerate(signal_noise_background):
+            idx = np.flatnonzero(pvalue_bool[:, i] & signal_bool[:, j])
+            merged = merge_fountains(
+                df.iloc[idx].reset_index(drop=True), max_distance=max_merge_distance
+            )
+            idx = idx[merged.index]
+
+            if output_format == 'npz':
+                save_fountain_table(f"{prefix}_{val}.npz", df.iloc[idx])
+            else:
+                output_tmp1 = f"{prefix}_{val}.tab"
+                df.iloc[idx].to_csv(output_tmp1, header=True, index=None, sep='\t')
+
+            output_tmp2 = f"{prefix}_{val}.bedpe"
+            bedpe.iloc[idx].to_csv(output_tmp2, header=True, index=None, sep='\t')
@@ -1,4 +1,5 @@
 import os
+import glob
 import cooler
 import click
 import logging
@@ -8,6 +9,7 @@ import pandas as pd
 
 from cli import cli
 from lib.find_peaks import find_peak_prominence
+from lib.util import iter_bigwig_track
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,7 +21,8 @@ logger = logging.getLogger(__name__)
 )
 @click.option(
     "--track",
-    help = "The absolute path of SoN tracks for all chroms",
+    help = "The absolute path of SoN tracks for all chroms (bedgraph or .bw), "
+    "or of the directory of chr*_SoN.bedgraph tracks of calculate-son-score",
     type = str
 )
 @click.option(
@@ -27,17 +30,23 @@ logger = logging.getLogger(__name__)
     help = "The absolute path for output directory",
     type = str
 )
+@click.option(
+    "--min_prominence",
+    help = "Only keep summits whose prominence of SoN is at least this value. "
+    "Default keeps all local maxima",
+    default = None,
+    type = float
+)
 
-def generate_summits(cool_path, track, out_dir):
+def generate_summits(cool_path, track, out_dir, min_prominence=None):
     """
     Find summits based on SoN
 
     """
 
-    # load cooler and SoN track
+    # load cooler
     logger.info('Starting Summits detection...')
     clr = cooler.Cooler(cool_path)
-    track_data = _load_track_data(track)
 
     # suffix
     resolution = clr.binsize
@@ -46,26 +55,100 @@ def generate_summits(cool_path, track, out_dir):
     out_dir = os.path.join(out_dir, 'SoN_summits/')
     os.makedirs(out_dir, exist_ok=True)
 
-    for chrom in clr.chromnames:
-        logger.info(f'Processing chromosome {chrom}...')
-        _process_chromosome_data('chr' + chrom, track_data, out_dir, suffix)
+    # summits are written as soon as the track of a chromosome is read
+    chroms = ['chr' + chrom for chrom in clr.chromnames]
+    for chrom, track_data in _iter_track_blocks(track):
+        if chrom in chroms:
+            logger.info(f'Processing chromosome {chrom[3:]}...')
+            _process_chromosome_data(chrom, track_data, out_dir, suffix, min_prominence)
+            chroms.remove(chrom)
+
+    # chromosomes without SoN
+    for chrom in chroms:
+        _process_chromosome_data(chrom, _load_track_data(None), out_dir, suffix, min_prominence)
 
     _merge_summits(out_dir, resolution)
 
 
-def _load_track_data(track_path):
+# rows of SoN tracks read at once
+TRACK_CHUNK_SIZE = 1000000
+
+# tracks read as bigWig
+BIGWIG_SUFFIXES = ('.bw', '.bigwig', '.bigWig')
+
+def _load_track_data(track_path, chunksize=None):
     """
-    Load track data from the given path.
+    Load track data from the given path, None for an empty track.
 
     """
+    if track_path is None:
+        return pd.DataFrame(columns=['chrom', 'start', 'end', 'SoN']).astype(
+            {'start': int, 'end': int, 'SoN': float}
+        )
+
     track_data = pd.read_table(
-        track_path, header=None, sep='\t', names = ['chrom', 'start', 'end', 'SoN']
+        track_path, header=None, sep='\t', names = ['chrom', 'start', 'end', 'SoN'],
+        chunksize=chunksize
     )
 
     return track_data
 
 
-def _process_chromosome_data(chrom, track, out_dir, suffix):
+def _iter_track_blocks(track_path, chunksize=TRACK_CHUNK_SIZE):
+    """
+    Stream SoN tracks and yield the rows of each chromosome.
+
+    Args:
+        track_path (str): Path to a SoN track whose rows are grouped by
+            chromosome, to a bigWig track, or to a directory of
+            chr*_SoN.bedgraph tracks.
+        chunksize (int): Number of rows read at once.
+
+    Returns:
+        Iterator of (chromosome, rows of the chromosome), only one
+        chromosome and one chunk are kept in memory.
+    """
+    if track_path.endswith(BIGWIG_SUFFIXES):
+        for chrom, track in iter_bigwig_track(track_path):
+            track.insert(0, 'chrom', chrom)
+            yield chrom, track.rename(columns={'value': 'SoN'})
+        return
+
+    if os.path.isdir(track_path):
+        track_paths = sorted(glob.glob(os.path.join(track_path, 'chr*_SoN.bedgraph')))
+    else:
+        track_paths = [track_path]
+
+    seen = set()
+    chrom, blocks = None, []
+    for path in track_paths:
+        for chunk in _load_track_data(path, chunksize):
+            chunk_chroms = chunk['chrom'].values
+
+            # contiguous runs of chromosomes in the chunk
+            starts = np.r_[0, np.flatnonzero(chunk_chroms[1:] != chunk_chroms[:-1]) + 1]
+            ends = np.r_[starts[1:], len(chunk)]
+
+            for start, end in zip(starts, ends):
+                if chunk_chroms[start] != chrom:
+                    if blocks:
+                        yield chrom, pd.concat(blocks)
+
+                    chrom, blocks = chunk_chroms[start], []
+                    if chrom in seen:
+                        raise ValueError(
+                            f'Rows of {chrom} are not contiguous in {track_path}, '
+                            'please sort the track by chromosome'
+                        )
+                    seen.add(chrom)
+
+                blocks.append(chunk.iloc[start:end])
+
+    if blocks:
+        yield chrom, pd.concat(blocks)
+
+
+def _process_chromosome_data(chrom, track, out_dir, suffix, min_prominence=None):
     """
     Process track data for a specific chromosome and write summits to file.
 
@@ -75,7 +158,9 @@ def _process_chromosome_data(chrom, track, out_dir, suffix):
     SoN_df.loc[:, 'SoN'] = SoN_df.loc[:, 'SoN'].clip(lower=0)
 
     # Get positions of summits
-    poss, _ = find_peak_prominence(SoN_df.loc[:, 'SoN'].values)
+    poss, _ = find_peak_prominence(
+        SoN_df.loc[:, 'SoN'].values, min_prominence=min_prominence
+    )
 
     chr_cord_start = SoN_df.loc[:, 'start'].values[poss]
     chr_cord_end = SoN_df.loc[:, 'end'].values[poss]
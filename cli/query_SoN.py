@@ -0,0 +1,33 @@
+import click
+
+from cli import cli
+from lib.son_store import SoNStore
+
+@cli.command()
+@click.argument(
+    "regions", metavar = 'REGION',
+    type = str, nargs = -1
+)
+@click.option(
+    "--store",
+    help = "SoN store written by calculate-son-score --track_format store",
+    required = True,
+    type = str
+)
+@click.option(
+    "--output",
+    help = "Output bedgraph, default is the standard output",
+    default = None,
+    type = str
+)
+
+def query_SoN(regions, store, output=None):
+    """
+    Print the SoN of regions (chrom:start-end or chrom) as bedgraph.
+
+    """
+    son_store = SoNStore(store)
+
+    with click.open_file(output or '-', 'w') as f:
+        for region in regions:
+            son_store.query(region).to_csv(f, sep='\t', header=False, index=False)
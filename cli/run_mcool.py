@@ -0,0 +1,301 @@
+import logging
+import click
+import cooler
+import os
+
+import pandas as pd
+
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+from cli import cli
+from cli.calculate_SoN import calculate_SoN_score
+from cli.find_summits import generate_summits
+from cli.calculate_extension_infor import find_fountains
+from lib.band_matrix import band_width, n_chrom_bins
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# parameters of each resolution, the lengths (bp) are scaled with bin size
+# as recommended by the help of calculate-son-score and find-fountains
+DEFAULT_PARAMS = {
+    'ext_length': 50,
+    'offset': 5,
+    'interval_length': 5,
+    'padding_width': 2,
+    'coverage_ratio': 0,
+    'norm': 'VC_SQRT',
+    'extension_pixels': '10,100,5',
+    'p_value': 0.05,
+    'signal_noise_background': '1.1,1.2,1.3,1.4,1.5',
+    'max_merge_distance': 50000,
+}
+SCALED_PARAMS = ['ext_length', 'offset', 'interval_length']
+
+@cli.command()
+@click.argument(
+    "mcool_path", metavar = 'MCOOL_PATH',
+    type = str, nargs = 1
+)
+@click.option(
+    "--out_dir",
+    help = "The output directory, results of each resolution "
+    "are written to <out_dir>/<resolution>",
+    type = str
+)
+@click.option(
+    "--chromsize_path",
+    help = "file containing chromsize",
+    type = str
+)
+@click.option(
+    "--resolutions",
+    help = "Resolutions to process, can be given multiple times. "
+    "Default is all resolutions of the .mcool",
+    multiple = True,
+    type = int
+)
+@click.option(
+    "--params",
+    help = "Tab-separated table of parameters with a 'resolution' column "
+    "and columns named as the options of calculate-son-score and "
+    "find-fountains (extension_pixels, p_value and signal_noise_background "
+    "are comma-separated). Missing values are scaled with bin size: "
+    "ext_length = 50, offset = 5 and interval_length = 5 bins",
+    default = None,
+    type = str
+)
+@click.option(
+    "--max_memory",
+    help = "Approximate memory budget (MB), resolutions are run "
+    "concurrently as long as they fit in it. 0 means one at a time",
+    default = 0,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--processes",
+    help = "Number of processes of calculate-son-score for each resolution",
+    default = 1,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--cache_dir",
+    help = "Directory of the on-disk cache of balanced matrices, "
+    "so that find-fountains reuses the matrices of calculate-son-score. "
+    "Default is <out_dir>/band_cache",
+    default = None,
+    type = str
+)
+
+def run_mcool(
+    mcool_path, out_dir, chromsize_path, resolutions=(),
+    params=None, max_memory=0, processes=1, cache_dir=None
+):
+    """
+    Run calculate-son-score, generate-summits and find-fountains
+    for every resolution of an .mcool file.
+
+    """
+    logger.info(f'Starting batch mode for {mcool_path}...')
+    cool_paths = _discover_resolutions(mcool_path, resolutions)
+    param_table = _load_param_table(params, cool_paths)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(out_dir, 'band_cache')
+
+    jobs = []
+    for resolution, cool_path in cool_paths.items():
+        res_params = param_table[resolution]
+        memory = _estimate_memory(cooler.Cooler(cool_path), res_params) * processes
+        jobs.append((memory, resolution, (
+            cool_path, os.path.join(out_dir, str(resolution)), chromsize_path,
+            res_params, processes, cache_dir, max_memory // processes
+        )))
+
+    _schedule_jobs(jobs, max_memory)
+
+    logger.info('Batch mode completed.')
+
+
+def _discover_resolutions(mcool_path, resolutions):
+    """
+    Find the coolers of an .mcool file.
+
+    Args:
+        mcool_path (str): Path to the .mcool file.
+        resolutions (tuple): Resolutions to keep, empty for all of them.
+
+    Returns:
+        Dict of resolution to cooler URI, from the finest resolution.
+    """
+    cool_paths = {}
+    for group in cooler.fileops.list_coolers(mcool_path):
+        uri = f'{mcool_path}::{group}'
+        cool_paths[cooler.Cooler(uri).binsize] = uri
+
+    if resolutions:
+        missing = set(resolutions) - set(cool_paths)
+        if missing:
+            raise ValueError(
+                f'Resolutions {sorted(missing)} are not found in {mcool_path}'
+            )
+        cool_paths = {i: cool_paths[i] for i in resolutions}
+
+    return dict(sorted(cool_paths.items()))
+
+
+def _load_param_table(params_path, cool_paths):
+    """
+    Parameters of each resolution.
+
+    Args:
+        params_path (str): Path to the table of parameters, None for defaults.
+        cool_paths (dict): Resolutions to process.
+
+    Returns:
+        Dict of resolution to dict of parameters.
+    """
+    if params_path is not None:
+        table = pd.read_table(params_path, sep='\t').set_index('resolution')
+        unknown = set(table.columns) - set(DEFAULT_PARAMS) - {'half_width'}
+        if unknown:
+            raise ValueError(f'Unknown parameters {sorted(unknown)} in {params_path}')
+    else:
+        table = pd.DataFrame()
+
+    param_table = {}
+    for resolution in cool_paths:
+        res_params = dict(DEFAULT_PARAMS)
+        for name in SCALED_PARAMS:
+            res_params[name] = DEFAULT_PARAMS[name] * resolution
+
+        if resolution in table.index:
+            row = table.loc[resolution]
+
+            # half_width of find-fountains is padding_width of calculate-son-score
+            row = row.rename({'half_width': 'padding_width'})
+            res_params.update({k: v for k, v in row.items() if not pd.isna(v)})
+
+        param_table[resolution] = res_params
+
+    return param_table
+
+
+def _estimate_memory(clr, res_params):
+    """
+    Approximate peak memory (MB) of a resolution.
+
+    Args:
+        clr (Cooler): Cooler object.
+        res_params (dict): Parameters of the resolution.
+
+    Returns:
+        Memory of the band of the largest chromosome, its prefix sums
+        and the layer-sum matrix.
+    """
+    resolution = clr.binsize
+    n_bins = max(n_chrom_bins(clr, chrom) for chrom in clr.chromnames)
+    n_diags = band_width(int(res_params['ext_length']), resolution)
+
+    return n_bins * (32 * n_diags + 16 * n_diags) / 1024 ** 2
+
+
+def _schedule_jobs(jobs, max_memory):
+    """
+    Run the resolutions in processes within a memory budget.
+
+    Args:
+        jobs (list): (memory, resolution, arguments of _run_resolution).
+        max_memory (int): Memory budget (MB), 0 for one resolution at a time.
+    """
+    pending = sorted(jobs, key=lambda job: job[0], reverse=True)
+    running = {}
+
+    while pending or running:
+        used = sum(memory for memory, _ in running.values())
+
+        # start the largest resolutions fitting in the budget,
+        # a resolution larger than the budget runs alone
+        for job in list(pending):
+            memory, resolution, args = job
+            if running and (max_memory <= 0 or used + memory > max_memory):
+                continue
+
+            logger.info(f'Starting resolution {resolution} (~{memory:.0f}MB)...')
+            process = Process(target=_run_resolution, args=args)
+            process.start()
+            running[process.sentinel] = (memory, (resolution, process))
+            pending.remove(job)
+            used += memory
+
+        for sentinel in wait(list(running)):
+            _, (resolution, process) = running.pop(sentinel)
+            process.join()
+
+            if process.exitcode != 0:
+                for _, (_, other) in running.values():
+                    other.terminate()
+                raise RuntimeError(
+                    f'Resolution {resolution} failed with exit code {process.exitcode}'
+                )
+
+            logger.info(f'Resolution {resolution} completed.')
+
+
+def _run_resolution(cool_path, out_dir, chromsize_path, res_params, processes, cache_dir, max_memory):
+    """
+    Run the three steps of the pipeline for one resolution.
+
+    """
+    clr = cooler.Cooler(cool_path)
+    resolution = clr.binsize
+    norm = res_params['norm']
+
+    calculate_SoN_score.callback(
+        cool_path=cool_path, out_dir=out_dir, chromsize_path=chromsize_path,
+        norm=norm, coverage_ratio=float(res_params['coverage_ratio']),
+        ext_length=int(res_params['ext_length']),
+        padding_width=int(res_params['padding_width']),
+        offset=int(res_params['offset']), integrate=True, use_mean=False,
+        max_memory=max_memory, processes=processes, cache_dir=cache_dir
+    )
+
+    generate_summits.callback(
+        cool_path=cool_path,
+        track=os.path.join(
+            out_dir, f'SoN_track_{resolution}', f'SoN_{resolution}_merged.bedgraph'
+        ),
+        out_dir=out_dir
+    )
+
+    # find-fountains reads summits without header
+    summits = pd.read_table(
+        os.path.join(out_dir, 'SoN_summits', f'Summits_{resolution}_merged.bed')
+    )
+    region_path = os.path.join(out_dir, f'summits_{resolution}.bed')
+    summits.to_csv(region_path, sep='\t', header=False, index=False)
+
+    find_fountains.callback(
+        cool_path=cool_path, half_width=int(res_params['padding_width']),
+        ext_length=int(res_params['ext_length']), region_path=region_path,
+        extension_pixels=_parse_list(res_params['extension_pixels'], int),
+        offset=int(res_params['offset']),
+        interval_length=int(res_params['interval_length']),
+        coverage_ratio=float(res_params['coverage_ratio']),
+        output=os.path.join(out_dir, f'fountains_{resolution // 1000}kb'),
+        norm=norm, p_value=_parse_list(res_params['p_value'], float),
+        signal_noise_background=_parse_list(res_params['signal_noise_background'], float),
+        max_merge_distance=int(res_params['max_merge_distance']),
+        cache_dir=cache_dir
+    )
+
+
+def _parse_list(value, dtype):
+    """
+    Parse a comma-separated parameter.
+
+    """
+    return [dtype(i) for i in str(value).split(',')]
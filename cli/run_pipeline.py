@@ -0,0 +1,359 @@
+import logging
+import click
+import cooler
+import os
+
+import numpy as np
+import pandas as pd
+
+from cli import cli
+from cli.calculate_SoN import (
+    _create_output_directory, _make_SoN_track, _merge_bedgraph_files,
+    _schedule_chromosomes, _SoN_checkpoint_key, _worker_pool, _write_SoN_tracks
+)
+from cli.calculate_extension_infor import (
+    _filter_options, _save_evaluation, _write_fountains
+)
+from cli.find_summits import _merge_summits
+from lib.band_matrix import fetch_band
+from lib.checkpoint import checkpoint_key, load_checkpoint, save_checkpoint
+from lib.find_peaks import find_peak_prominence
+from lib.fountain_extension import (
+    evaluate_chrom_summits, evaluation_checkpoint_key, sort_by_chrom,
+    summit_plumb_length
+)
+from lib.signal_over_noise import calculate_signal_noise_ratio_track
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# columns of the evaluation, see `evaluate_summits`
+RESULT_COLUMNS = [
+    'max_extension', 'signal_noise_upstream', 'signal_noise_downstream',
+    'signal_noise_average_background', 'p_value'
+]
+
+@cli.command()
+@click.argument(
+    "cool_path", metavar = 'COOL_PATH',
+    type = str, nargs = 1
+)
+@click.option(
+    "--out_dir",
+    help = "The output directory, fountains are written to "
+    "<out_dir>/fountains_<resolution in kb>kb_<threshold of SoN>, "
+    "with _p<threshold of p-value> before the SoN when several p-values are given",
+    type = str
+)
+@click.option(
+    "--norm",
+    help = "The normalization method for hic matrix"
+    "(VC_SQRT, VC and KR normalization)",
+    default = 'VC_SQRT',
+    show_default = True,
+    type = str
+)
+@click.option(
+    "--coverage_ratio",
+    help = "Given the targeted init bin for plumb,"
+    "if the coverage of bins your collect is lower than "
+    "this threshold, we consider it as NaNs.",
+    default = 0,
+    show_default = True,
+    type = float
+)
+@click.option(
+    "--ext_length",
+    help = "The length of sampling box (bp) of SoN and fountains",
+    default = 500000,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--padding_width", "--half_width", "padding_width",
+    help = "Number of bins padded on each side of the sampling box, "
+    "padding_width of calculate-son-score and half_width of find-fountains",
+    default = 2,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--offset",
+    help = "Offset (bp) of calculate-son-score and find-fountains, "
+    "as in run-mcool",
+    default = 50000,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--use_mean",
+    help = "Use mean for SoN score calculation in pixels from sampling regions else median",
+    default = False,
+    show_default = True,
+    type = bool
+)
+@click.option(
+    "--min_prominence",
+    help = "Summits whose prominence of SoN is lower than it are dropped",
+    default = None,
+    type = float
+)
+@click.option(
+    "--extension_pixels",
+    help = "Array of locations we used to calculate dominance in extension",
+    nargs = 3,
+    default = (10, 100, 5),
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--interval_length",
+    help = "This param determines the length (bp) of sliding sheet containing "
+    "multiple layers.",
+    default = 50000,
+    show_default = True,
+    type = int
+)
+@_filter_options
+@click.option(
+    "--write_son",
+    help = "Also write the SoN tracks as calculate-son-score",
+    is_flag = True,
+    default = False
+)
+@click.option(
+    "--write_summits",
+    help = "Also write the summits as generate-summits",
+    is_flag = True,
+    default = False
+)
+@click.option(
+    "--checkpoint_dir",
+    help = "Directory of per-chromosome checkpoints of SoN, summits and "
+    "their evaluation (shared with calculate-son-score and find-fountains), "
+    "a rerun resumes from them. Default is no checkpoint",
+    default = None,
+    type = str
+)
+@click.option(
+    "--processes",
+    help = "Number of processes, chromosomes are scheduled "
+    "onto the processes from the largest one",
+    default = 1,
+    show_default = True,
+    type = int
+)
+
+def run(
+    cool_path, out_dir, norm='VC_SQRT', coverage_ratio=0, ext_length=500000,
+    padding_width=2, offset=50000, use_mean=False,
+    min_prominence=None, extension_pixels=(10, 100, 5), interval_length=50000,
+    p_value=(0.05,), signal_noise_background=(1.1, 1.2, 1.3, 1.4, 1.5),
+    max_merge_distance=50000, output_format='tab', write_son=False,
+    write_summits=False, checkpoint_dir=None, processes=1
+):
+    """
+    Run calculate-son-score, generate-summits and find-fountains
+    in one pass over each chromosome.
+
+    """
+    logger.info('Starting fountain pipeline...')
+    clr = cooler.Cooler(cool_path)
+    resolution = clr.binsize
+    os.makedirs(out_dir, exist_ok=True)
+
+    bin_array = np.arange(
+        extension_pixels[0], extension_pixels[1], extension_pixels[2]
+    )
+    tasks = [
+        (cool_path, chrom, norm, coverage_ratio, ext_length, padding_width,
+         offset, use_mean, min_prominence, bin_array, interval_length,
+         checkpoint_dir)
+        for chrom in _schedule_chromosomes(clr)
+    ]
+
+    if write_son:
+        SoN_dir = _create_output_directory(out_dir, resolution)
+    if write_summits:
+        summits_dir = os.path.join(out_dir, 'SoN_summits/')
+        os.makedirs(summits_dir, exist_ok=True)
+
+    # the tracks and summits of each chromosome are written as it completes,
+    # an interrupted run keeps those of the finished chromosomes
+    summits = {}
+    with _worker_pool(processes) as pool:
+        if pool is not None:
+            results = pool.imap_unordered(_run_chromosome, tasks)
+        else:
+            results = map(_run_chromosome, tasks)
+
+        for chrom, SoN_score, chrom_summits in results:
+            summits[chrom] = chrom_summits
+            if write_son:
+                _write_SoN(clr, SoN_dir, chrom, SoN_score)
+            if write_summits:
+                _write_summits(summits_dir, resolution, chrom, chrom_summits)
+
+    if write_son:
+        _merge_bedgraph_files(SoN_dir, resolution)
+    if write_summits:
+        _merge_summits(summits_dir, resolution)
+
+    # same row order as find-fountains on the summits of generate-summits
+    df = sort_by_chrom(
+        pd.concat([summits[chrom] for chrom in clr.chromnames], ignore_index=True)
+    )
+
+    output = os.path.join(out_dir, f'fountains_{resolution // 1000}kb')
+    _save_evaluation(
+        df, output, resolution, half_width=padding_width, ext_length=ext_length,
+        norm=norm, extension_pixels=extension_pixels, offset=offset,
+        interval_length=interval_length, coverage_ratio=coverage_ratio
+    )
+    _write_fountains(
+        df, output, resolution, p_value, signal_noise_background,
+        max_merge_distance, output_format
+    )
+
+    logger.info('Fountain pipeline completed.')
+
+
+def _run_chromosome(args):
+    """
+    SoN, summits and their evaluation for one chromosome.
+
+    Args:
+        args (tuple): Path to the cooler file, chromosome name, the
+            parameters of the three steps and the checkpoint directory.
+
+    Returns:
+        Chromosome name, SoN scores and the evaluated summits.
+    """
+    (cool_path, chrom, norm, coverage_ratio, ext_length, padding_width, offset,
+     use_mean, min_prominence, bin_array, interval_length, checkpoint_dir) = args
+    logger.info(f'Processing chromosome {chrom}...')
+
+    clr = cooler.Cooler(cool_path)
+    resolution = clr.binsize
+
+    # one band serves both the SoN and the evaluation of summits,
+    # it is only fetched if one of them is not restored
+    mat = None
+    plumb_length = summit_plumb_length(ext_length, interval_length, resolution)
+
+    # same keys as calculate-son-score and find-fountains
+    SoN_key = _SoN_checkpoint_key(
+        clr, chrom, norm, coverage_ratio, ext_length, padding_width, offset, use_mean
+    )
+    SoN_score = _restore(checkpoint_dir, 'SoN', chrom, SoN_key)
+    if SoN_score is None:
+        mat = fetch_band(clr, chrom, norm, plumb_length)
+        SoN_score = calculate_signal_noise_ratio_track(
+            mat=mat, extension_length=ext_length,
+            resolution=resolution, half_width=padding_width,
+            offset=offset, coverage_ratio=coverage_ratio, use_mean=use_mean
+        )
+        _record(checkpoint_dir, 'SoN', chrom, SoN_key, SoN_score)
+
+    summits_key = checkpoint_key(
+        clr, 'summits', chrom, SoN=SoN_key, min_prominence=min_prominence
+    )
+    summits = _restore(checkpoint_dir, 'summits', chrom, summits_key)
+    if summits is None:
+        summits = _find_chrom_summits(clr, chrom, SoN_score, min_prominence)
+        _record(checkpoint_dir, 'summits', chrom, summits_key, summits)
+
+    init_bins = (summits['end'].values + summits['start'].values) // resolution // 2
+    evaluation_key = evaluation_checkpoint_key(
+        clr, chrom, init_bins, padding_width, ext_length, norm, bin_array,
+        offset, coverage_ratio, interval_length, threshold = 0.5
+    )
+    result = _restore(checkpoint_dir, 'evaluation', chrom, evaluation_key)
+    if result is None:
+        if mat is None:
+            mat = fetch_band(clr, chrom, norm, plumb_length)
+        result = evaluate_chrom_summits(
+            mat, init_bins, padding_width, ext_length, bin_array, offset,
+            coverage_ratio, resolution, interval_length = interval_length,
+            threshold = 0.5
+        )
+        _record(checkpoint_dir, 'evaluation', chrom, evaluation_key, result)
+
+    perc_res_list, res_arr = result
+    summits = summits.copy()
+    summits['perc_res_list'] = perc_res_list
+    for column, values in zip(RESULT_COLUMNS, res_arr):
+        summits[column] = values
+
+    return chrom, SoN_score, summits
+
+
+def _find_chrom_summits(clr, chrom, SoN_score, min_prominence):
+    """
+    Summits of the SoN of a chromosome, as generate-summits.
+
+    Returns:
+        Summits with 'chrom', 'start', 'end', 'name', 'score' and 'strand'
+        columns, as read by find-fountains.
+    """
+    resolution = clr.binsize
+
+    # same as the track of calculate-son-score read by generate-summits
+    SoN_track = np.clip(np.nan_to_num(SoN_score, nan=0, posinf=0, neginf=0), 0, None)
+    poss, _ = find_peak_prominence(SoN_track, min_prominence=min_prominence)
+
+    return pd.DataFrame({
+        'chrom': np.repeat('chr' + chrom, len(poss)),
+        'start': poss * resolution,
+        'end': np.minimum((poss + 1) * resolution, int(clr.chromsizes[chrom])),
+        'name': np.repeat('.', len(poss)),
+        'score': SoN_track[poss],
+        'strand': np.repeat('.', len(poss))
+    })
+
+
+def _restore(checkpoint_dir, stage, chrom, key):
+    """
+    Result of a stage from its checkpoint, None if not recorded.
+
+    """
+    if checkpoint_dir is None:
+        return None
+
+    result = load_checkpoint(checkpoint_dir, stage, chrom, key)
+    if result is not None:
+        logger.info(f'{stage} of chromosome {chrom} restored from checkpoint')
+
+    return result
+
+
+def _record(checkpoint_dir, stage, chrom, key, result):
+    """
+    Record the result of a stage if checkpoints are enabled.
+
+    """
+    if checkpoint_dir is not None:
+        save_checkpoint(checkpoint_dir, stage, chrom, key, result)
+
+
+def _write_SoN(clr, SoN_dir, chrom, SoN_score):
+    """
+    Write the SoN track of a chromosome as calculate-son-score.
+
+    """
+    chromsize = clr.chromsizes.rename(lambda chrom: 'chr' + chrom)
+    SoN_track = _make_SoN_track(chrom, SoN_score, clr.binsize, chromsize)
+    _write_SoN_tracks(SoN_dir, chrom, clr.binsize, SoN_track)
+
+
+def _write_summits(summits_dir, resolution, chrom, chrom_summits):
+    """
+    Write the summits of a chromosome as generate-summits.
+
+    """
+    chrom_summits.iloc[:, :6].rename(
+        columns={'chrom': 'chr', 'score': 'SoN'}
+    ).to_csv(
+        os.path.join(summits_dir, f'chr{chrom}_{resolution // 1000}kb.bed'),
+        sep='\t', header=True, index=None
+    )
@@ -0,0 +1,327 @@
+import bioframe
+import logging
+import click
+import cooler
+import os
+
+import numpy as np
+import pandas as pd
+
+from cli import cli
+from cli.calculate_SoN import (
+    _calculate_SoN_worker, _create_output_directory, _make_SoN_track,
+    _merge_bedgraph_files, _split_tiles, _worker_pool, _write_SoN_tracks
+)
+from cli.find_summits import _merge_summits
+from lib.band_matrix import n_chrom_bins
+from lib.find_peaks import find_peak_prominence
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@cli.command()
+@click.argument(
+    "cool_path", metavar = 'COOL_PATH',
+    type = str, nargs = 1
+)
+@click.option(
+    "--coarse_path",
+    help = "Cooler of the coarse resolution used for screening, "
+    "e.g. input.mcool::resolutions/50000",
+    type = str
+)
+@click.option(
+    "--out_dir",
+    help = "The output directory of SoNs and summits",
+    type = str
+)
+@click.option(
+    "--chromsize_path",
+    help = "file containing chromsize",
+    type = str
+)
+@click.option(
+    "--norm",
+    help = "The normalization method for hic matrix"
+    "(VC_SQRT, VC and KR normalization)",
+    default = 'VC_SQRT',
+    show_default = True,
+    type = str
+)
+@click.option(
+    "--coverage_ratio",
+    help = "Given the targeted init bin for plumb,"
+    "if the coverage of bins your collect is lower than "
+    "this threshold, we consider it as NaNs.",
+    default = 0,
+    show_default = True,
+    type = float
+)
+@click.option(
+    "--ext_length",
+    help = "The length of sampling box (bp) at both resolutions",
+    default = 500000,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--padding_width",
+    help = "Number of bins padded on each side of the sampling box "
+    "at both resolutions",
+    default = 2,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--offset",
+    help = "We do not consider length of extension below this threshold (bp)",
+    default = 20000,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--use_mean",
+    help = "Use mean for SoN score calculation in pixels from sampling regions else median",
+    default = False,
+    show_default = True,
+    type = bool
+)
+@click.option(
+    "--min_prominence",
+    help = "Screening threshold, the coarse peaks whose prominence of SoN "
+    "is lower than it are not refined",
+    default = 0,
+    show_default = True,
+    type = float
+)
+@click.option(
+    "--window",
+    help = "Length (bp) refined at high resolution on each side of a coarse peak",
+    default = 100000,
+    show_default = True,
+    type = int
+)
+@click.option(
+    "--exhaustive_summits",
+    help = "Summits found by generate-summits on the exhaustive high-resolution "
+    "SoN, to report the fraction of them recovered by the screening",
+    default = None,
+    type = str
+)
+@click.option(
+    "--processes",
+    help = "Number of processes",
+    default = 1,
+    show_default = True,
+    type = int
+)
+
+def screen_summits(
+    cool_path, coarse_path, out_dir, chromsize_path, norm='VC_SQRT',
+    coverage_ratio=0, ext_length=500000, padding_width=2, offset=20000,
+    use_mean=False, min_prominence=0, window=100000,
+    exhaustive_summits=None, processes=1
+):
+    """
+    Find summits coarse-to-fine: screen SoN peaks at a coarse resolution
+    and compute high-resolution SoN only around them.
+
+    """
+    logger.info('Starting coarse-to-fine summit search...')
+    clr = cooler.Cooler(cool_path)
+    coarse_clr = cooler.Cooler(coarse_path)
+    resolution, coarse_resolution = clr.binsize, coarse_clr.binsize
+    chromsize = bioframe.read_chromsizes(chromsize_path, natsort=True)
+    chroms = [chrom for chrom in clr.chromnames if chrom in coarse_clr.chromnames]
+
+    SoN_args = (norm, ext_length, padding_width, offset, coverage_ratio, use_mean)
+
+    with _worker_pool(processes) as pool:
+        pool_map = pool.map if pool is not None else map
+
+        # screen the whole chromosomes at coarse resolution
+        logger.info(f'Screening SoN peaks at {coarse_resolution}...')
+        coarse_SoN = {
+            chrom: SoN_score for chrom, _, SoN_score in pool_map(_calculate_SoN_worker, [
+                (coarse_path, chrom, bin_start, bin_end, *SoN_args, coarse_resolution)
+                for chrom, bin_start, bin_end in _split_tiles(coarse_clr, chroms, None)
+            ])
+        }
+
+        windows = {
+            chrom: _candidate_windows(
+                coarse_SoN[chrom], coarse_resolution, resolution,
+                n_chrom_bins(clr, chrom), min_prominence, window
+            ) for chrom in chroms
+        }
+
+        # refine the windows at high resolution
+        logger.info(f'Refining SoN around candidates at {resolution}...')
+        fine_SoN = {chrom: np.full(n_chrom_bins(clr, chrom), np.nan) for chrom in chroms}
+        for chrom, bin_start, SoN_score in pool_map(_calculate_SoN_worker, [
+            (cool_path, chrom, bin_start, bin_end, *SoN_args, resolution)
+            for chrom in chroms for bin_start, bin_end in windows[chrom]
+        ]):
+            fine_SoN[chrom][bin_start: bin_start + len(SoN_score)] = SoN_score
+
+    # tracks of the refined bins and summits
+    out_dir_path = _create_output_directory(out_dir, resolution)
+    summits_dir = os.path.join(out_dir, 'SoN_summits/')
+    os.makedirs(summits_dir, exist_ok=True)
+
+    n_screened = 0
+    for chrom in chroms:
+        SoN_track = _make_SoN_track(chrom, fine_SoN[chrom], resolution, chromsize)
+        is_screened = ~np.isnan(fine_SoN[chrom])
+        n_screened += is_screened.sum()
+
+        if is_screened.any():
+            _write_SoN_tracks(out_dir_path, chrom, resolution, SoN_track[is_screened])
+        _window_summits('chr' + chrom, SoN_track, windows[chrom]).to_csv(
+            os.path.join(summits_dir, f'chr{chrom}_{resolution // 1000}kb.bed'),
+            sep='\t', header=True, index=None
+        )
+
+    if n_screened > 0:
+        _merge_bedgraph_files(out_dir_path, resolution)
+    _merge_summits(summits_dir, resolution)
+
+    n_bins = sum(len(fine_SoN[chrom]) for chrom in chroms)
+    logger.info(
+        f'High-resolution SoN computed for {n_screened} of {n_bins} bins '
+        f'({n_screened / n_bins:.1%})'
+    )
+
+    if exhaustive_summits is not None:
+        _report_accuracy(
+            exhaustive_summits,
+            os.path.join(summits_dir, f'Summits_{resolution}_merged.bed'),
+            windows, resolution
+        )
+
+
+def _candidate_windows(coarse_SoN, coarse_resolution, resolution, n_bins, min_prominence, window):
+    """
+    High-resolution bins to refine around the coarse SoN peaks.
+
+    Args:
+        coarse_SoN (ndarray): SoN scores at coarse resolution.
+        min_prominence (float): Prominence threshold of the coarse peaks.
+        window (int): Length (bp) refined on each side of a peak.
+
+    Returns:
+        Sorted list of disjoint (first bin, last bin + 1) at high resolution.
+    """
+    # same as generate-summits, negative SoN are ignored
+    SoN_score = np.clip(np.nan_to_num(coarse_SoN, nan=0, posinf=0, neginf=0), 0, None)
+    poss, proms = find_peak_prominence(SoN_score)
+    poss = poss[proms >= min_prominence]
+
+    starts = np.maximum((poss * coarse_resolution - window) // resolution, 0)
+    ends = np.minimum(-(-((poss + 1) * coarse_resolution + window) // resolution), n_bins)
+
+    # merge the overlapping windows
+    windows = []
+    for start, end in sorted(zip(starts, ends)):
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+
+    return [(int(start), int(end)) for start, end in windows]
+
+
+def _window_summits(chrom, SoN_track, windows):
+    """
+    Summits of the SoN within the refined windows, as generate-summits.
+
+    Peaks are called in each window separately, the bins outside the
+    windows have no SoN. A peak on the first or last bin of a window is
+    dropped unless the bin ends the chromosome, as the SoN of its outer
+    neighbour is unknown.
+
+    Args:
+        chrom (str): Chromosome name, with 'chr'.
+        SoN_track (DataFrame): SoN track of the whole chromosome.
+        windows (list): Refined windows, see _candidate_windows.
+
+    Returns:
+        Summits with 'chr', 'start', 'end', 'name', 'SoN' and 'strand' columns.
+    """
+    SoN = SoN_track['value'].clip(lower=0).values
+    n_bins = len(SoN)
+
+    poss = []
+    for start, end in windows:
+        window_poss, _ = find_peak_prominence(SoN[start:end])
+        is_edge = ((window_poss == 0) & (start > 0)) | \
+            ((window_poss == end - start - 1) & (end < n_bins))
+        poss.append(start + window_poss[~is_edge])
+
+    poss = np.concatenate(poss).astype(np.int64) if poss else np.zeros(0, dtype=np.int64)
+
+    return pd.DataFrame({
+        'chr': np.repeat(chrom, len(poss)),
+        'start': SoN_track['start'].values[poss],
+        'end': SoN_track['end'].values[poss],
+        'name': np.repeat('.', len(poss)),
+        'SoN': SoN[poss],
+        'strand': np.repeat('.', len(poss))
+    })
+
+
+def _report_accuracy(exhaustive_path, screened_path, windows, resolution):
+    """
+    Report the recall and precision of the screening against the summits
+    of an exhaustive run.
+
+    Args:
+        exhaustive_path (str): Summits of the exhaustive SoN.
+        screened_path (str): Summits of the screened SoN.
+        windows (dict): Refined windows of each chromosome.
+        resolution (int): High resolution.
+    """
+    exhaustive = _read_summits(exhaustive_path)
+    screened = _read_summits(screened_path)
+
+    if len(exhaustive) == 0:
+        logger.info('No exhaustive summits to compare with.')
+        return
+
+    exhaustive_index = exhaustive.set_index(['chrom', 'start']).index
+    screened_index = screened.set_index(['chrom', 'start']).index
+    is_found = exhaustive_index.isin(screened_index)
+    is_true = screened_index.isin(exhaustive_index)
+
+    in_window = np.zeros(len(exhaustive), dtype=bool)
+    for chrom, chrom_windows in windows.items():
+        is_chrom = (exhaustive['chrom'] == 'chr' + chrom).values
+        bins = exhaustive['start'].values[is_chrom] // resolution
+        for start, end in chrom_windows:
+            in_window[np.where(is_chrom)[0][(bins >= start) & (bins < end)]] = True
+
+    logger.info(
+        f'Recovered {is_found.sum()} of {len(exhaustive)} exhaustive summits '
+        f'({is_found.mean():.1%}), {in_window.mean():.1%} of them '
+        f'lie in the refined windows'
+    )
+    if len(screened) > 0:
+        logger.info(
+            f'{is_true.sum()} of {len(screened)} screened summits are '
+            f'exhaustive summits (precision {is_true.mean():.1%})'
+        )
+
+
+def _read_summits(path):
+    """
+    Read summits written by generate-summits, with or without header.
+
+    """
+    summits = pd.read_table(path, header=None, sep='\t').iloc[:, :3]
+    summits.columns = ['chrom', 'start', 'end']
+
+    # header line
+    if len(summits) > 0 and summits.iloc[0]['chrom'] == 'chr':
+        summits = summits.iloc[1:]
+
+    return summits.astype({'start': int, 'end': int})
@@ -0,0 +1,164 @@
+import bioframe
+import logging
+import click
+import cooler
+import os
+
+from cli import cli
+from cli.calculate_SoN import (
+    _make_SoN_track, _merge_bedgraph_files,
+    _schedule_chromosomes, _worker_pool, _write_SoN_tracks
+)
+from lib.band_matrix import fetch_band
+from lib.signal_over_noise import calculate_signal_noise_ratio_sweep
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@cli.command()
+@click.argument(
+    "cool_path", metavar = 'COOL_PATH',
+    type = str, nargs = 1
+)
+@click.option(
+    "--out_dir",
+    help = "The output directory of SoNs",
+    type = str
+)
+@click.option(
+    "--chromsize_path",
+    help = "file containing chromsize",
+    type = str
+)
+@click.option(
+    "--norm",
+    help = "The normalization method for hic matrix"
+    "(VC_SQRT, VC and KR normalization)",
+    default = 'VC_SQRT',
+    show_default = True,
+    type = str
+)
+@click.option(
+    "--coverage_ratio",
+    help = "Given the targeted init bin for plumb,"
+    "if the coverage of bins your collect is lower than "
+    "this threshold, we consider it as NaNs.",
+    default = 0,
+    show_default = True,
+    type = float
+)
+@click.option(
+    "--ext_length",
+    help = "Grid of lengths of sampling box (bp), can be given multiple times",
+    multiple = True,
+    type = int
+)
+@click.option(
+    "--padding_width",
+    help = "Grid of padding widths (bins), can be given multiple times",
+    multiple = True,
+    type = int
+)
+@click.option(
+    "--offset",
+    help = "Grid of offsets (bp), can be given multiple times",
+    multiple = True,
+    type = int
+)
+@click.option(
+    "--use_mean",
+    help = "Use mean for SoN score calculation in pixels from sampling regions else median",
+    default = False,
+    show_default = True,
+    type = bool
+)
+@click.option(
+    "--processes",
+    help = "Number of processes, chromosomes are scheduled "
+    "onto the processes from the largest one",
+    default = 1,
+    show_default = True,
+    type = int
+)
+
+def sweep_SoN_score(
+    cool_path, out_dir, chromsize_path, norm='VC_SQRT', coverage_ratio=0,
+    ext_length=(), padding_width=(), offset=(), use_mean=False, processes=1
+):
+    """
+    Calculate SoN tracks for every combination of ext_length,
+    padding_width and offset.
+
+    """
+    if not (ext_length and padding_width and offset):
+        raise click.UsageError('--ext_length, --padding_width and --offset are required')
+
+    logger.info('Starting SoN parameter sweep...')
+    clr = cooler.Cooler(cool_path)
+    resolution = clr.binsize
+    chromsize = bioframe.read_chromsizes(chromsize_path, natsort=True)
+    out_dir = os.path.join(out_dir, f'SoN_sweep_{resolution}')
+
+    tasks = [
+        (cool_path, chrom, norm, ext_length, padding_width, offset, coverage_ratio, use_mean)
+        for chrom in _schedule_chromosomes(clr)
+    ]
+
+    combination_dirs = set()
+    with _worker_pool(processes) as pool:
+        if pool is not None:
+            results = pool.imap_unordered(_sweep_SoN_worker, tasks)
+        else:
+            results = map(_sweep_SoN_worker, tasks)
+
+        for chrom, SoN_scores in results:
+            for params, SoN_score in SoN_scores:
+                combination_dir = os.path.join(out_dir, _combination_name(*params))
+                os.makedirs(combination_dir, exist_ok=True)
+                combination_dirs.add(combination_dir)
+
+                SoN_track = _make_SoN_track(chrom, SoN_score, resolution, chromsize)
+                _write_SoN_tracks(combination_dir, chrom, resolution, SoN_track)
+
+    for combination_dir in sorted(combination_dirs):
+        _merge_bedgraph_files(combination_dir, resolution)
+
+    n_skipped = len(ext_length) * len(padding_width) * len(offset) - len(combination_dirs)
+    if n_skipped > 0:
+        logger.info(f'{n_skipped} combinations with offset exceeding ext_length are skipped.')
+
+    logger.info('SoN parameter sweep completed.')
+
+
+def _sweep_SoN_worker(args):
+    """
+    Calculate SoN scores of one chromosome for all combinations.
+
+    Args:
+        args (tuple): Path to the cooler file, chromosome name, normalization,
+            grids of ext_length, padding_width and offset, coverage ratio
+            and use_mean.
+
+    Returns:
+        Chromosome name and list of ((padding_width, ext_length, offset), SoN scores).
+    """
+    cool_path, chrom, norm, ext_lengths, padding_widths, offsets, coverage_ratio, use_mean = args
+    logger.info(f'Processing chromosome {chrom}...')
+
+    # the band of the longest extension serves all combinations
+    clr = cooler.Cooler(cool_path)
+    mat = fetch_band(clr, chrom, norm, max(ext_lengths))
+
+    return chrom, list(calculate_signal_noise_ratio_sweep(
+        mat, half_widths=padding_widths, extension_lengths=ext_lengths,
+        offsets=offsets, resolution=clr.binsize,
+        coverage_ratio=coverage_ratio, use_mean=use_mean
+    ))
+
+
+def _combination_name(padding_width, ext_length, offset):
+    """
+    Name of the output directory of a combination.
+
+    """
+    return f'ext_{ext_length}_pw_{padding_width}_offset_{offset}'
@@ -0,0 +1,166 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+from .util import stale_tmp_files
+
+
+def band_cache_key(clr, chrom, norm):
+    '''
+    Content address of the balanced band of a chromosome
+
+    Notes:
+    The key is built from (cooler URI, mtime, resolution, norm, chrom),
+    a rewritten cooler file gets a new key.
+    '''
+    mtime = os.path.getmtime(clr.filename)
+    key = repr((clr.uri, mtime, clr.binsize, norm, chrom))
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _cached_bands(cache_dir, key):
+    '''
+    Cached bands of a key, as a list of (n_diags, path)
+    '''
+    cached = []
+    for path in glob.glob(os.path.join(cache_dir, f'{key}_*.npy')):
+        n_diags = os.path.basename(path)[len(key) + 1:-len('.npy')]
+        if n_diags.isdigit():
+            cached.append((int(n_diags), path))
+
+    return sorted(cached)
+
+
+def load_cached_band(cache_dir, key, n_diags):
+    '''
+    Open a cached band with at least `n_diags` diagonals
+
+    Returns
+    -------
+    band : memmap object
+        read-only array of shape (n_diags, n_bins), None if not cached
+    '''
+    for width, path in _cached_bands(cache_dir, key):
+        if width < n_diags:
+            continue
+
+        try:
+            band = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            # evicted by another process
+            continue
+
+        # mark as recently used
+        os.utime(path)
+
+        # the first diagonals are contiguous, no copy is made
+        return band[:n_diags]
+
+    return None
+
+
+def create_cached_band(cache_dir, key, n_diags, n_bins):
+    '''
+    Create an on-disk band to be filled, see `commit_cached_band`
+
+    Returns
+    -------
+    band : memmap object
+        writable array of shape (n_diags, n_bins) filled with 0
+
+    path : str object
+        temporary path of the band
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{key}_{n_diags}.npy.{os.getpid()}.tmp')
+    band = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float64, shape=(n_diags, n_bins)
+    )
+
+    return band, path
+
+
+def commit_cached_band(cache_dir, key, band, tmp_path, cache_size = 0):
+    '''
+    Publish a band filled after `create_cached_band`
+
+    Notes:
+    The file is renamed atomically, so that concurrent commands never read
+    a partial band. The narrower bands of the same key and the partial
+    bands of crashed processes are removed, and the least recently used
+    bands are evicted when the cache exceeds `cache_size` (MB, 0 means
+    unlimited).
+
+    Returns
+    -------
+    band : memmap object
+        read-only band
+    '''
+    n_diags = band.shape[0]
+    band.flush()
+    del band
+
+    path = os.path.join(cache_dir, f'{key}_{n_diags}.npy')
+    os.replace(tmp_path, path)
+
+    for width, old_path in _cached_bands(cache_dir, key):
+        if width < n_diags:
+            _remove(old_path)
+
+    if cache_size > 0:
+        evict_cache(cache_dir, cache_size, keep=path)
+    else:
+        _remove_stale_bands(cache_dir)
+
+    return np.load(path, mmap_mode='r')
+
+
+def evict_cache(cache_dir, cache_size, keep = None):
+    '''
+    Remove the least recently used bands until the cache fits in
+    `cache_size` (MB), `keep` is never removed
+
+    Notes:
+    The partial bands left by crashed processes are removed first, the
+    bands being filled by running processes count against `cache_size`.
+    '''
+    _remove_stale_bands(cache_dir)
+
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*.npy*')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(i[1] for i in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= cache_size * 1024 ** 2:
+            break
+
+        # bands being filled are never evicted
+        if path.endswith('.tmp'):
+            continue
+
+        if path != keep and _remove(path):
+            total_size -= size
+
+
+def _remove_stale_bands(cache_dir):
+    '''
+    Remove the partial bands left by crashed processes
+    '''
+    for path in stale_tmp_files(os.path.join(cache_dir, '*.npy.*.tmp')):
+        _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+
+    return True
@@ -0,0 +1,256 @@
+import numpy as np
+
+from .band_cache import *
+
+
+class BandMatrix(object):
+    '''
+    Banded storage of a symmetric hic matrix
+
+    Only the pixels within `n_diags` diagonals of the main diagonal are kept,
+    in a (diagonal-offset x bin) array, so that band[d, i] = mat[i, i + d].
+    The object can be used in place of the dense matrix by `plumb_sum`,
+    `set_background` and `center_area_plumb_sum`, which only rely on
+    `mat.shape` and `mat[row_idx, col_idx]`.
+
+    Parameters
+    ----------
+    band: ndarray object
+        array of shape (n_diags, bin_end - bin_start)
+
+    bin_start: int object
+        the first bin of the chromosome stored in the band
+
+    n_bins: int object
+        number of bins of the whole chromosome,
+        default is the number of bins stored in the band
+
+    Notes:
+    As in the dense matrix, the pixels of bins without balancing weight
+    are NaNs and the pixels absent from the pixel table are 0.
+
+    When only a range of bins [bin_start, bin_end) is stored, the indices
+    are still the bins of the whole chromosome, and only the pixels with
+    both bins within the range are available.
+    '''
+
+    def __init__(self, band, bin_start = 0, n_bins = None):
+        self.band = band
+        self.n_diags = band.shape[0]
+        self.bin_start = bin_start
+        self.bin_end = bin_start + band.shape[1]
+        self.n_bins = self.bin_end if n_bins is None else n_bins
+        self._prefix_sums = None
+
+    @property
+    def shape(self):
+        return self.n_bins, self.n_bins
+
+    def __getitem__(self, key):
+        row_idx, col_idx = key
+        row_idx = np.asarray(row_idx)
+        col_idx = np.asarray(col_idx)
+
+        # the matrix is symmetric, we always read the upper triangle
+        diag_idx = np.abs(col_idx - row_idx)
+        row_idx = np.minimum(row_idx, col_idx)
+
+        if np.any(diag_idx >= self.n_diags):
+            raise IndexError(
+                'The pixels exceed the band of matrix, '
+                'please use a larger extension length'
+            )
+
+        if np.any(row_idx < self.bin_start) or \
+                np.any(row_idx + diag_idx >= self.bin_end):
+            raise IndexError('The pixels exceed the range of stored bins')
+
+        return self.band[diag_idx, row_idx - self.bin_start]
+
+    def prefix_sums(self):
+        '''
+        Cumulative sums along each diagonal of the band (built once)
+
+        Returns
+        -------
+        cum_sum : ndarray object
+            cum_sum[d, i] is the nansum of band[d, :i],
+            i is relative to `bin_start`
+
+        cum_cnt : ndarray object
+            cum_cnt[d, i] is the number of non-zero pixels in band[d, :i]
+        '''
+        if self._prefix_sums is None:
+            band = np.where(np.isnan(self.band), 0, self.band)
+
+            cum_sum = np.zeros((self.n_diags, band.shape[1] + 1), dtype=np.float64)
+            np.cumsum(band, axis=1, out=cum_sum[:, 1:])
+
+            cum_cnt = np.zeros((self.n_diags, band.shape[1] + 1), dtype=np.int64)
+            np.cumsum(band != 0, axis=1, out=cum_cnt[:, 1:])
+
+            self._prefix_sums = cum_sum, cum_cnt
+
+        return self._prefix_sums
+
+
+def band_width(extension_length, resolution):
+    '''
+    Number of diagonals touched by plumb layers at given extension length
+    '''
+    return int(extension_length // resolution) * 2 + 1
+
+
+def n_chrom_bins(clr, chrom):
+    '''
+    Number of bins of a chromosome
+    '''
+    return -(-int(clr.chromsizes[chrom]) // clr.binsize)
+
+
+def plumb_bin_range(bin_start, bin_end, half_width, extension_length, resolution, n_bins):
+    '''
+    Range of bins whose pixels are touched by the sampling boxes
+    at init bins in [bin_start, bin_end)
+    '''
+    ext_bins = int(extension_length // resolution)
+
+    return max(bin_start - half_width - ext_bins, 0), \
+           min(bin_end + half_width + ext_bins, n_bins)
+
+
+# pixels of the pixel table read at once
+PIXEL_CHUNK_SIZE = 1000000
+
+# balancing weights applied by division, as in `cooler.Cooler.matrix`
+DIVISIVE_WEIGHTS = {'KR', 'VC', 'VC_SQRT'}
+
+def balancing_weights(clr, norm, bin_start, bin_end, divisive_weights = None):
+    '''
+    Multiplicative balancing weights of bins [bin_start, bin_end) of the cooler
+
+    Notes:
+    Like `clr.matrix(balance=norm)`, the weights named KR, VC or VC_SQRT
+    are divisive, the others are multiplicative, `divisive_weights` overrides
+    the names of divisive weights. Returns None without norm.
+    '''
+    if not norm:
+        return None
+
+    name = norm if isinstance(norm, str) else 'weight'
+    weights = clr.bins()[name][bin_start:bin_end].values.astype(np.float64)
+
+    if divisive_weights is None:
+        divisive_weights = DIVISIVE_WEIGHTS
+
+    if name in divisive_weights:
+        weights = 1 / weights
+
+    return weights
+
+
+def _fill_band(clr, chrom, norm, band, bin_start, chunk_size = PIXEL_CHUNK_SIZE):
+    '''
+    Scatter the balanced pixels of bins [bin_start, bin_start + band.shape[1])
+    into `band` in place
+
+    Notes:
+    The pixel table is streamed `chunk_size` pixels at a time from the rows
+    of the bins (the pixels are sorted by bin1_id, see `indexes/bin1_offset`),
+    and only the pixels within the band are kept, so memory is proportional
+    to the chunk size plus the band.
+    '''
+    n_diags, width = band.shape
+    first_bin = clr.offset(chrom) + bin_start
+    weights = balancing_weights(clr, norm, first_bin, first_bin + width)
+
+    with clr.open('r') as grp:
+        pixel_start, pixel_end = grp['indexes']['bin1_offset'][
+            [first_bin, first_bin + width]
+        ]
+
+    pixels = clr.pixels(join=False)
+    for start in range(pixel_start, pixel_end, chunk_size):
+        chunk = pixels[start: min(start + chunk_size, pixel_end)]
+        row_idx = chunk['bin1_id'].values - first_bin
+        col_idx = chunk['bin2_id'].values - first_bin
+        data = chunk['count'].values.astype(np.float64)
+        del chunk
+
+        diag_idx = col_idx - row_idx
+        cond = (diag_idx >= 0) & (diag_idx < n_diags) & (col_idx < width)
+        row_idx, col_idx, diag_idx, data = \
+            row_idx[cond], col_idx[cond], diag_idx[cond], data[cond]
+
+        if weights is not None:
+            data *= weights[row_idx] * weights[col_idx]
+
+        band[diag_idx, row_idx] = data
+
+    # bins without balancing weight
+    if weights is not None:
+        is_nan = np.isnan(weights)
+
+        for diag in range(min(n_diags, width)):
+            cond = is_nan[:width - diag] | is_nan[diag:]
+            band[diag, :width - diag][cond] = np.nan
+
+
+def fetch_band(clr, chrom, norm, extension_length, bin_range = None, cache_dir = None, cache_size = 0):
+    '''
+    Build the banded matrix of a chromosome from the cooler pixel table
+
+    Parameters
+    ----------
+    clr: Cooler object
+
+    chrom: str object
+        chromosome name
+
+    norm: str object
+        the normalization method for hic matrix
+
+    extension_length: int object
+        the length of extension (bp)
+
+    bin_range: tuple object
+        (bin_start, bin_end) of the chromosome to fetch, default is
+        the whole chromosome
+
+    cache_dir: str object
+        directory of the on-disk cache of balanced bands, default is no cache
+
+    cache_size: int object
+        maximum size (MB) of the cache, 0 means unlimited
+
+    Returns
+    -------
+    band_mat : BandMatrix object
+        balanced matrix in banded storage, memory is O(n_bins x n_diags)
+
+    Notes:
+    With `cache_dir`, the band of the whole chromosome is stored once as a
+    .npy file (see `lib.band_cache`) and later calls, in this or other
+    commands, open it as a read-only memmap. A cached band with more
+    diagonals is reused for shorter extensions.
+    '''
+    n_diags = band_width(extension_length, clr.binsize)
+    n_bins = n_chrom_bins(clr, chrom)
+    bin_start, bin_end = (0, n_bins) if bin_range is None else bin_range
+
+    if cache_dir is None:
+        band = np.zeros((n_diags, bin_end - bin_start), dtype=np.float64)
+        _fill_band(clr, chrom, norm, band, bin_start)
+
+        return BandMatrix(band, bin_start=bin_start, n_bins=n_bins)
+
+    key = band_cache_key(clr, chrom, norm)
+    band = load_cached_band(cache_dir, key, n_diags)
+
+    if band is None:
+        # filled in place, the band is never held in memory
+        band, tmp_path = create_cached_band(cache_dir, key, n_diags, n_bins)
+        _fill_band(clr, chrom, norm, band, 0)
+        band = commit_cached_band(cache_dir, key, band, tmp_path, cache_size)
+
+    return BandMatrix(band[:, bin_start:bin_end], bin_start=bin_start, n_bins=n_bins)
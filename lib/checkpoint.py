@@ -0,0 +1,143 @@
+import os
+import glob
+import pickle
+import hashlib
+import numpy as np
+
+from .util import stale_tmp_files
+
+# the records start with the sha256 digest of their payload
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
+# records kept for each stage and chromosome, the least recently
+# used ones (other parameters, summits or cooler mtime) are removed
+MAX_RECORDS = 8
+
+
+def _normalize(value):
+    '''
+    Parameter value with a stable repr, so that e.g. 0 and 0.0 or
+    arrays of different dtypes give the same key
+    '''
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value, dtype=np.float64)
+        return hashlib.sha1(value.tobytes()).hexdigest(), value.shape
+
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(i) for i in value)
+
+    return value
+
+
+def checkpoint_key(clr, stage, chrom, **params):
+    '''
+    Key of the checkpoint of a stage for a chromosome
+
+    Notes:
+    The key is built from the cooler (URI, mtime and resolution, as
+    `band_cache_key`), the stage, the chromosome and the parameters,
+    so that records of different parameters live side by side.
+    '''
+    mtime = os.path.getmtime(clr.filename)
+    params = sorted((name, _normalize(value)) for name, value in params.items())
+    key = repr((clr.uri, mtime, clr.binsize, stage, chrom, params))
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _checkpoint_records(checkpoint_dir, stage, chrom):
+    '''
+    Records of a stage for a chromosome, as a list of (mtime, path)
+    '''
+    records = []
+    for path in glob.glob(os.path.join(checkpoint_dir, stage, '*.pkl')):
+        name, _, _ = os.path.basename(path).rsplit('.', 2)
+        if name != chrom:
+            continue
+
+        try:
+            records.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+
+    return records
+
+
+def _checkpoint_path(checkpoint_dir, stage, chrom, key):
+    return os.path.join(checkpoint_dir, stage, f'{chrom}.{key}.pkl')
+
+
+def load_checkpoint(checkpoint_dir, stage, chrom, key):
+    '''
+    Load the result of a stage for a chromosome
+
+    Returns
+    -------
+    result: object
+        None if there is no record of the key, or if the record is
+        incomplete or corrupted
+    '''
+    path = _checkpoint_path(checkpoint_dir, stage, chrom, key)
+    try:
+        with open(path, 'rb') as f:
+            record = f.read()
+    except OSError:
+        return None
+
+    digest, payload = record[:_DIGEST_SIZE], record[_DIGEST_SIZE:]
+    if hashlib.sha256(payload).digest() != digest:
+        return None
+
+    # mark as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return pickle.loads(payload)
+
+
+def save_checkpoint(checkpoint_dir, stage, chrom, key, result, max_records = MAX_RECORDS):
+    '''
+    Record the result of a stage for a chromosome
+
+    Notes:
+    The record is written to a temporary file and renamed atomically, so
+    that an interrupted run never leaves a partial record. The record of
+    the same key is replaced, the records of other keys are kept up to
+    `max_records` per stage and chromosome, the least recently used ones
+    are removed. The partial records of crashed processes are removed.
+    '''
+    os.makedirs(os.path.join(checkpoint_dir, stage), exist_ok=True)
+    path = _checkpoint_path(checkpoint_dir, stage, chrom, key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(tmp_path, 'wb') as f:
+        f.write(hashlib.sha256(payload).digest())
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+    records = sorted(_checkpoint_records(checkpoint_dir, stage, chrom), reverse=True)
+    for _, old_path in records[max_records:]:
+        if old_path != path:
+            _remove(old_path)
+
+    for old_path in stale_tmp_files(os.path.join(checkpoint_dir, stage, '*.pkl.*.tmp')):
+        _remove(old_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -5,6 +5,8 @@ import warnings
 import numpy as np
 import matplotlib.pyplot as plt
 
+from .band_matrix import BandMatrix, band_width, plumb_bin_range
+
 @numba.jit(nopython=True)
 def plumb_numbda(half_width, init_bin, extension_length, n_bins, offset, resolution):
     '''
@@ -53,6 +55,191 @@ def plumb_numbda(half_width, init_bin, extension_length, n_bins, offset, resolut
         yield row_idx, col_idx
 
 
+@numba.jit(nopython=True, nogil=True)
+def plumb_layer_bounds(half_width, init_bin, extension_length, n_bins, offset, resolution):
+    '''
+    Row ranges of the layers generated by `plumb_numbda`
+
+    Notes:
+    Each layer i of `plumb_numbda` is a run of consecutive rows on the
+    diagonal i (col = row + i), so it can be described by its first and last
+    row. The odd layers are derived from the previous even layer after the
+    boundary filter, exactly as `plumb_numbda` does.
+
+    * The layer is empty if hi < lo
+    '''
+
+    extension_bins = (extension_length // resolution) * 2
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    assert offset_bins < extension_bins+1, \
+        'The offset should not exceed length of extension'
+
+    n_layers = extension_bins - offset_bins + 1
+    lo_arr = np.zeros(n_layers, dtype=np.int64)
+    hi_arr = np.zeros(n_layers, dtype=np.int64)
+
+    # layers start from an empty array when the first layer is odd
+    row_lo, row_hi = 0, -1
+    for k in range(n_layers):
+        i = offset_bins + k
+        if i % 2 == 0:
+            row_lo = init_bin - half_width - i // 2
+            row_hi = init_bin + half_width - i // 2
+
+        elif row_hi - row_lo + 1 > 1:
+            row_hi = row_hi - 1
+
+        # Do not exceed the boundaries
+        row_lo = max(row_lo, 0)
+        row_hi = min(row_hi, n_bins - 1 - i)
+
+        lo_arr[k] = row_lo
+        hi_arr[k] = row_hi
+
+    return lo_arr, hi_arr
+
+
+@numba.jit(nopython=True, nogil=True)
+def plumb_sum_prefix(cum_sum, cum_cnt, bin_start, half_width, init_bin, extension_length, n_bins, offset, resolution):
+    '''
+    Same as `plumb_sum`, but each layer is a O(1) lookup of the prefix sums
+    along the diagonals
+
+    Parameters
+    ----------
+    cum_sum: ndarray object
+        cumulative nansum along each diagonal, shape (n_diags, n_bins + 1)
+
+    cum_cnt: ndarray object
+        cumulative count of non-zero pixels along each diagonal
+
+    bin_start: int object
+        the bin of chromosome at the first column of prefix sums
+
+    Returns
+    -------
+    vals : ndarray object
+        sum of interaction at each distance
+    '''
+
+    lo_arr, hi_arr = plumb_layer_bounds(
+        half_width, init_bin, extension_length, n_bins, offset, resolution
+    )
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    vals = np.empty(len(lo_arr), dtype=np.float64)
+    for k in range(len(lo_arr)):
+        lo, hi = lo_arr[k] - bin_start, hi_arr[k] - bin_start
+        diag = offset_bins + k
+
+        if hi < lo:
+            vals[k] = np.nan
+
+        # keep exact zeros, they are counted by the coverage ratio
+        elif cum_cnt[diag, hi + 1] - cum_cnt[diag, lo] == 0:
+            vals[k] = 0.0
+
+        else:
+            vals[k] = cum_sum[diag, hi + 1] - cum_sum[diag, lo]
+
+    return vals
+
+
+@numba.jit(nopython=True, nogil=True)
+def plumb_layer_sums_prefix(cum_sum, cum_cnt, bin_start, half_width, init_start, init_end, extension_length, n_bins, offset, resolution):
+    '''
+    Layer sums of the sampling boxes at init bins in [init_start, init_end)
+
+    Returns
+    -------
+    layer_sums : ndarray object
+        array of shape (init_end - init_start, n_layers)
+    '''
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    n_layers = (extension_length // resolution) * 2 - offset_bins + 1
+    layer_sums = np.empty((init_end - init_start, n_layers), dtype=np.float64)
+    for init_bin in range(init_start, init_end):
+        layer_sums[init_bin - init_start] = plumb_sum_prefix(
+            cum_sum, cum_cnt, bin_start, half_width, init_bin,
+            extension_length, n_bins, offset, resolution
+        )
+
+    return layer_sums
+
+
+@numba.jit(nopython=True, nogil=True)
+def plumb_sums_prefix(cum_sum, cum_cnt, bin_start, half_width, init_bins, extension_length, n_bins, offset, resolution):
+    '''
+    Layer sums of the sampling boxes at a batch of init bins
+
+    Returns
+    -------
+    layer_sums : ndarray object
+        array of shape (len(init_bins), n_layers)
+    '''
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    n_layers = (extension_length // resolution) * 2 - offset_bins + 1
+    layer_sums = np.empty((len(init_bins), n_layers), dtype=np.float64)
+    for k in range(len(init_bins)):
+        layer_sums[k] = plumb_sum_prefix(
+            cum_sum, cum_cnt, bin_start, half_width, init_bins[k],
+            extension_length, n_bins, offset, resolution
+        )
+
+    return layer_sums
+
+
+@numba.jit(nopython=True, nogil=True)
+def sampling_box_sums_prefix(cum_sum, cum_cnt, bin_start, half_width, init_bins, extension_length, n_bins, offset, resolution):
+    '''
+    Layer sums of the center, upstream and downstream sampling boxes
+    for each init bin
+
+    Returns
+    -------
+    box_sums : ndarray object
+        array of shape (len(init_bins), 3, n_layers)
+    '''
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    shift = 2 * half_width + 1
+    n_layers = (extension_length // resolution) * 2 - offset_bins + 1
+    box_sums = np.empty((len(init_bins), 3, n_layers), dtype=np.float64)
+    for k in range(len(init_bins)):
+        for j in range(3):
+            # center, upstream and downstream
+            init_bin = init_bins[k] + (0, -shift, shift)[j]
+            box_sums[k, j] = plumb_sum_prefix(
+                cum_sum, cum_cnt, bin_start, half_width, init_bin,
+                extension_length, n_bins, offset, resolution
+            )
+
+    return box_sums
+
+
 @numba.jit(nopython=True)
 def nb_sum(x):
     sum_ = 0
@@ -60,6 +247,42 @@ def nb_sum(x):
         sum_ += x[i]
     return sum_
 
+def n_plumb_layers(extension_length, offset, resolution):
+    '''
+    Number of layers generated by `plumb_numbda` at given extension length
+    '''
+    extension_bins = int(extension_length // resolution) * 2
+
+    if offset != 0:
+        offset_bins = (offset // resolution) * 2 + 1
+    else:
+        offset_bins = 0
+
+    return extension_bins - offset_bins + 1
+
+
+def check_band_range(band_mat, half_width, init_start, init_end, extension_length, resolution):
+    '''
+    Make sure that the sampling boxes at init bins in [init_start, init_end)
+    lie within the bins stored by a banded matrix
+    '''
+    start, end = plumb_bin_range(
+        init_start, init_end, half_width, extension_length, resolution, band_mat.shape[0]
+    )
+
+    if start < band_mat.bin_start or end > band_mat.bin_end:
+        raise IndexError(
+            f'Sampling boxes need bins [{start}, {end}), '
+            f'but only [{band_mat.bin_start}, {band_mat.bin_end}) are stored'
+        )
+
+    if band_width(extension_length, resolution) > band_mat.n_diags:
+        raise IndexError(
+            'The pixels exceed the band of matrix, '
+            'please use a larger extension length'
+        )
+
+
 def plumb_sum(mat, half_width, init_bin, extension_length, resolution, offset):
     '''
     calculate sum of interactions in sampling box at target bin
@@ -81,6 +304,19 @@ def plumb_sum(mat, half_width, init_bin, extension_length, resolution, offset):
         sum of interaction at each distance
     '''
 
+    # banded matrix: layer sums are looked up from prefix sums
+    if isinstance(mat, BandMatrix):
+        check_band_range(mat, half_width, init_bin, init_bin + 1, extension_length, resolution)
+
+        cum_sum, cum_cnt = mat.prefix_sums()
+        for val in plumb_sum_prefix(
+            cum_sum, cum_cnt, mat.bin_start, half_width, init_bin,
+            int(extension_length), mat.shape[0], offset, resolution
+        ):
+            yield val
+
+        return
+
     for row_idx, col_idx in plumb_numbda(
         half_width=half_width,
         init_bin=init_bin,
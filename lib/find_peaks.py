@@ -1,4 +1,96 @@
-def find_peak_prominence(arr, max_dist=None):
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True)
+def _range_nanmin(table, start, end):
+    """Minimum of arr[start:end] from the sparse table, NaN if all are NaNs."""
+    k = 0
+    while (1 << (k + 1)) <= end - start:
+        k += 1
+
+    val = min(table[k, start], table[k, end - (1 << k)])
+    return np.nan if np.isinf(val) else val
+
+
+@numba.jit(nopython=True)
+def _peak_prominence_kernel(arr, loc_max_poss, max_dist):
+    """Adjacent higher peaks and left/right prominences of the local maxima.
+    The nearest higher points are found with a monotonic stack and the lowest
+    points in between with a sparse table of range minima, NaNs are skipped
+    as in `np.nanmin`.
+    """
+    n = len(arr)
+
+    # nearest strictly higher point on each side
+    prev_higher = np.full(n, -1, dtype=np.int64)
+    next_higher = np.full(n, -1, dtype=np.int64)
+    stack = np.empty(n, dtype=np.int64)
+
+    top = 0
+    for i in range(n):
+        if np.isnan(arr[i]):
+            continue
+        while top > 0 and arr[stack[top - 1]] <= arr[i]:
+            top -= 1
+        if top > 0:
+            prev_higher[i] = stack[top - 1]
+        stack[top] = i
+        top += 1
+
+    top = 0
+    for i in range(n - 1, -1, -1):
+        if np.isnan(arr[i]):
+            continue
+        while top > 0 and arr[stack[top - 1]] <= arr[i]:
+            top -= 1
+        if top > 0:
+            next_higher[i] = stack[top - 1]
+        stack[top] = i
+        top += 1
+
+    # sparse table of range minima, NaNs are ignored
+    n_levels = 1
+    while (1 << n_levels) <= n:
+        n_levels += 1
+
+    table = np.empty((n_levels, n), dtype=np.float64)
+    for i in range(n):
+        table[0, i] = np.inf if np.isnan(arr[i]) else arr[i]
+    for k in range(1, n_levels):
+        half = 1 << (k - 1)
+        for i in range(n - (1 << k) + 1):
+            table[k, i] = min(table[k - 1, i], table[k - 1, i + half])
+
+    n_max = len(loc_max_poss)
+    left_maxs = np.full(n_max, -1, dtype=np.int64)
+    right_maxs = np.full(n_max, -1, dtype=np.int64)
+    left_proms = np.full(n_max, np.nan)
+    right_proms = np.full(n_max, np.nan)
+
+    for i in range(n_max):
+        pos = loc_max_poss[i]
+
+        # the first higher point, or the point `max_dist` away
+        left = max(prev_higher[pos], pos - max_dist - 1)
+        if left >= 0:
+            left_maxs[i] = left
+
+        right = next_higher[pos]
+        if right == -1 or right - pos > max_dist:
+            right = pos + max_dist + 1
+        if right < n:
+            right_maxs[i] = right
+
+        if left >= 0:
+            left_proms[i] = arr[pos] - _range_nanmin(table, left, pos)
+        if right < n:
+            right_proms[i] = arr[pos] - _range_nanmin(table, pos, right)
+
+    return left_maxs, right_maxs, left_proms, right_proms
+
+
+def find_peak_prominence(arr, max_dist=None, min_prominence=None):
     """Find the local maxima of an array and their prominence.
     The prominence of a peak is defined as the maximal difference between the
     height of the peak and the lowest point in the range until a higher peak.
@@ -8,6 +100,9 @@ def find_peak_prominence(arr, max_dist=None):
     max_dist : int
         If specified, the distance to the adjacent higher peaks is limited
         by `max_dist`.
+    min_prominence : float
+        If specified, only the maxima with a prominence of at least
+        `min_prominence` are returned.
     Returns
     -------
     loc_max_poss : numpy.array
@@ -15,7 +110,6 @@ def find_peak_prominence(arr, max_dist=None):
     proms : numpy.array
         The prominence of the detected maxima.
     """
-    import numpy as np
     import warnings
 
     arr = np.asarray(arr)
@@ -45,43 +139,11 @@ def find_peak_prominence(arr, max_dist=None):
     # For each maximum, find the position of a higher peak on the left and
     # on the right. If there are no higher peaks within the `max_dist` range,
     # just use the position `max_dist` away.
-    left_maxs = -1 * np.ones(len(loc_max_poss), dtype=np.int64)
-    right_maxs = -1 * np.ones(len(loc_max_poss), dtype=np.int64)
-
-    for i, pos in enumerate(loc_max_poss):
-        for j in range(pos - 1, -1, -1):
-            if (arr[j] > arr[pos]) or (pos - j > max_dist):
-                left_maxs[i] = j
-                break
-
-        for j in range(pos + 1, n):
-            if (arr[j] > arr[pos]) or (j - pos > max_dist):
-                right_maxs[i] = j
-                break
-
     # Find the prominence of each peak with respect of the lowest point
     # between the peak and the adjacent higher peaks, on the left and the right
     # separately.
-    left_max_proms = np.array(
-        [
-            (
-                arr[pos] - np.nanmin(arr[left_maxs[i] : pos])
-                if (left_maxs[i] >= 0)
-                else np.nan
-            )
-            for i, pos in enumerate(loc_max_poss)
-        ]
-    )
-
-    right_max_proms = np.array(
-        [
-            (
-                arr[pos] - np.nanmin(arr[pos : right_maxs[i]])
-                if (right_maxs[i] >= 0)
-                else np.nan
-            )
-            for i, pos in enumerate(loc_max_poss)
-        ]
+    left_maxs, right_maxs, left_max_proms, right_max_proms = _peak_prominence_kernel(
+        arr.astype(np.float64), loc_max_poss.astype(np.int64), max_dist
     )
 
     # In 1D, the topographic definition of the prominence of a peak reduces to
@@ -115,4 +177,8 @@ def find_peak_prominence(arr, max_dist=None):
                 arr[max(global_max_pos - max_dist, 0) : global_max_pos + max_dist]
             )
 
+    if min_prominence is not None:
+        keep = max_proms >= min_prominence
+        loc_max_poss, max_proms = loc_max_poss[keep], max_proms[keep]
+
     return loc_max_poss, max_proms
\ No newline at end of file
@@ -1,71 +1,139 @@
 from .signal_over_noise import *
+from .band_matrix import fetch_band
+from .checkpoint import checkpoint_key, load_checkpoint, save_checkpoint
 import logging
+import numba
 
 # logging.basicConfig(format='%(levelname)s:%(funcName)s:%(message)s', level=logging.DEBUG)
-def find_maximum_extension(signal_track, resolution, interval_length = 50000, threshold = 0.5):
+@numba.jit(nopython=True)
+def _maximum_extension_kernel(tracks, half_width, threshold):
+    """Stop bin of the sliding sheet of each track, the fraction of pixels
+    <= 0 is counted incrementally as the sheet slides, n_bins if it never
+    reaches `threshold`."""
+    n_tracks, length = tracks.shape
+    n_bins = 2 * half_width + 1
+    res = np.full(n_tracks, n_bins, dtype=np.int64)
+
+    for k in range(n_tracks):
+        track = tracks[k]
+        n_dominance = 0
+        for j in range(min(n_bins - 1, length)):
+            n_dominance += track[j] <= 0
+
+        for i in range(half_width, length - half_width):
+            n_dominance += track[i + half_width] <= 0
+            if i > half_width:
+                n_dominance -= track[i - half_width - 1] <= 0
+
+            if n_dominance / n_bins >= threshold:
+                # bin with max value in the sheet, the first NaN as np.argmax
+                max_idx = i - half_width
+                for j in range(i - half_width + 1, i + half_width + 1):
+                    if np.isnan(track[max_idx]):
+                        break
+                    if np.isnan(track[j]) or track[j] > track[max_idx]:
+                        max_idx = j
+
+                res[k] = max_idx
+                break
+
+    return res
+
+
+@numba.jit(nopython=True)
+def _dominance_kernel(tracks, bin_array, threshold):
+    """Fraction of pixels > threshold in track[:idx] for each idx of
+    `bin_array`, from one cumulative count per track."""
+    n_tracks, length = tracks.shape
+    res = np.empty((n_tracks, len(bin_array)))
+    cum_cnt = np.zeros(length + 1, dtype=np.int64)
+
+    for k in range(n_tracks):
+        for j in range(length):
+            cum_cnt[j + 1] = cum_cnt[j] + (tracks[k, j] > threshold)
+
+        for m in range(len(bin_array)):
+            idx = min(bin_array[m], length)
+            res[k, m] = cum_cnt[idx] / idx
+
+    return res
+
+
+def maximum_extension_batch(tracks, resolution, interval_length = 50000, threshold = 0.5):
+    '''
+    `find_maximum_extension` for each row of `tracks`
+
+    Parameters
+    ----------
+    tracks: ndarray object
+        array of shape (n_tracks, n_layers)
+
+    Returns
+    -------
+    max_ext: ndarray object
+        the stop bin of each track
+    '''
+    half_width = interval_length // resolution - 1
+
+    if half_width < 0:
+        raise ValueError('interval_length should not be shorter than resolution')
+
+    return _maximum_extension_kernel(
+        np.ascontiguousarray(tracks, dtype=np.float64), half_width, threshold
+    )
 
-    if not isinstance(signal_track, np.ndarray):
-        raise TypeError('Invalid signal track, please use ndarray!')
 
-    n_bins = (interval_length // resolution) * 2 - 1
+def dominance_batch(tracks, bin_array, threshold = 0):
+    '''
+    `calculate_dominance` for each row of `tracks`
 
+    Parameters
+    ----------
+    tracks: ndarray object
+        array of shape (n_tracks, n_layers)
 
-    #half_width = interval_length // 2 // resolution * 2
-    half_width = interval_length//resolution - 1
+    Returns
+    -------
+    percent: ndarray object
+        array of shape (n_tracks, bin_array[0] - 1 + len(bin_array)),
+        the first bin_array[0] - 1 columns are NaNs
+    '''
+    bin_array = np.asarray(bin_array, dtype=np.int64)
 
-    for i in range(0, len(signal_track)):
+    if bin_array[0] < 1:
+        raise ValueError('The first index should greater than 0, otherwise empty')
 
-        if i < half_width or i + half_width > len(signal_track) - 1:
-            n_dominance = np.nan
+    if bin_array.size > tracks.shape[1]:
+        raise ValueError(
+            'The index in bin_array should not exceed the bound of ndarray'
+        )
 
-        else:
-            signal = signal_track[i - half_width: i + half_width + 1]
-            n_dominance = signal[signal <= 0].size
+    percent = _dominance_kernel(
+        np.ascontiguousarray(tracks, dtype=np.float64), bin_array, float(threshold)
+    )
 
-        # we could stop at the bin i
-        if n_dominance / n_bins >= threshold:
+    if bin_array[0] > 1:
+        percent = np.hstack([np.full((len(percent), bin_array[0] - 1), np.nan), percent])
 
-            # then we should find the bin with max value
-            #max_idx = np.argmax(signal_track[i - half_width: i+1])
+    return percent
 
-            max_idx = np.argmax(signal_track[i-half_width:i+half_width+1])
 
-            obtained_idx = i - n_bins // 2 + max_idx
+def find_maximum_extension(signal_track, resolution, interval_length = 50000, threshold = 0.5):
 
-            return obtained_idx
+    if not isinstance(signal_track, np.ndarray):
+        raise TypeError('Invalid signal track, please use ndarray!')
 
-    return n_bins
+    return maximum_extension_batch(
+        signal_track[None], resolution, interval_length, threshold
+    )[0]
 
 
 def calculate_dominance(signal_track, bin_array, threshold = 0):
 
-    if bin_array[0] < 1:
-        raise ValueError('The first index should greater than 0, otherwise empty')
-
-    if isinstance(signal_track, np.ndarray):
-        percent_list = []
-        # logging.debug('The shape of signal_track is %d' % signal_track.shape)
-        # logging.debug('The length of bin array is %d' % bin_array.shape)
-
-        if bin_array.size > signal_track.size:
-            raise ValueError(
-                'The index in bin_array should not exceed the bound of ndarray'
-            )
-
-        for idx in bin_array:
-            signal = signal_track[:idx]
-            percent = signal[signal > threshold].size / signal.size
-            percent_list.append(percent)
-
-    else:
+    if not isinstance(signal_track, np.ndarray):
         raise TypeError('Signal track must be type of ndarray!')
 
-    percent_list = np.asarray(percent_list)
-
-    if bin_array[0] > 1:
-        percent_list = np.append(np.repeat(np.nan, bin_array[0] - 1), percent_list)
-
-    return percent_list
+    return dominance_batch(signal_track[None], bin_array, threshold)[0]
 
 def center_background_plumb(
     mat, half_width, extension_length, init_bin, resolution,
@@ -153,13 +221,222 @@ def set_sampling_box(
 
     return tkg_plumb, up_bkg, down_bkg
 
+def sampling_box_plumb_sum(mat, half_width, extension_length, init_bins, resolution, offset):
+    '''
+    Plumb sums of the center, upstream and downstream sampling boxes
+    for a batch of init bins, empty layers are NaNs
+
+    Returns
+    -------
+    box_sums: ndarray object
+        array of shape (len(init_bins), 3, n_layers)
+    '''
+    init_bins = np.asarray(init_bins, dtype=np.int64)
+    shift = 2 * half_width + 1
+
+    if isinstance(mat, BandMatrix):
+        if len(init_bins) > 0:
+            check_band_range(
+                mat, half_width, init_bins.min() - shift, init_bins.max() + shift + 1,
+                extension_length, resolution
+            )
+
+        cum_sum, cum_cnt = mat.prefix_sums()
+        return sampling_box_sums_prefix(
+            cum_sum, cum_cnt, mat.bin_start, half_width, init_bins,
+            int(extension_length), mat.shape[0], offset, resolution
+        )
+
+    box_sums = np.empty(
+        (len(init_bins), 3, n_plumb_layers(extension_length, offset, resolution))
+    )
+    for k, init_bin in enumerate(init_bins):
+        for j, bin_idx in enumerate([init_bin, init_bin - shift, init_bin + shift]):
+            box_sums[k, j] = [i for i in plumb_sum(
+                mat = mat, half_width = half_width,
+                init_bin = bin_idx, extension_length = extension_length,
+                resolution = resolution, offset = offset
+            )]
+
+    return box_sums
+
+
+def _box_coverage(box_sums, n_layers, coverage_ratio):
+    '''
+    Whether the coverage ratios of the three sampling boxes within their
+    first `n_layers` layers (one per summit) are above `coverage_ratio`
+    '''
+    if coverage_ratio is None:
+        raise ValueError('Empty coverage ratio.')
+
+    n_nonzero = np.cumsum(box_sums != 0, axis=2)
+    n_nonzero = n_nonzero[np.arange(len(box_sums)), :, n_layers - 1]
+
+    return (n_nonzero / n_layers[:, None] > coverage_ratio).all(axis=1)
+
+
+def _summit_layers(max_extension, offset, resolution):
+    '''
+    Number of layers within the maximum extension (Kb) of each summit,
+    and whether the summit can be evaluated
+    '''
+    extension_length = np.asarray(max_extension, dtype=np.float64) * 1000
+    is_valid = ~np.isnan(extension_length) & (offset < extension_length)
+
+    n_layers = np.ones(len(extension_length), dtype=np.int64)
+    n_layers[is_valid] = [
+        n_plumb_layers(i, offset, resolution) for i in extension_length[is_valid]
+    ]
+
+    return n_layers, is_valid
+
+
+def extension_batch(
+    box_sums, extension_length, resolution, offset, bin_array,
+    coverage_ratio = 0.2, interval_length = 50000, threshold = 0.5
+):
+    '''
+    Batched `center_background_plumb` from the plumb sums of sampling boxes
+
+    Notes:
+    The plumb sums could be calculated at a longer extension length,
+    only the first layers within `extension_length` are used.
+
+    Returns
+    -------
+    perc_res_list: list object
+        dominance at each pixel of `bin_array` for each summit
+
+    max_extension: ndarray object
+        the maximum extension (Kb) of each summit
+    '''
+    n_layers = n_plumb_layers(extension_length, offset, resolution)
+
+    # the empty layers are counted as 0 (see `calculate_coverage`)
+    box_sums = np.nan_to_num(box_sums[:, :, :n_layers], nan=0)
+    is_valid = _box_coverage(
+        box_sums, np.full(len(box_sums), n_layers), coverage_ratio
+    )
+
+    tkg_bkg_subtract = box_sums[:, 0] - (box_sums[:, 1] + box_sums[:, 2]) / 2
+
+    perc_res_list = [list(np.zeros_like(bin_array)) for _ in range(len(box_sums))]
+    max_extension = np.full(len(box_sums), np.nan)
+
+    if is_valid.any():
+        # all valid summits at once
+        max_ext = maximum_extension_batch(
+            tkg_bkg_subtract[is_valid], resolution = resolution,
+            interval_length = interval_length, threshold = threshold
+        )
+        percent = dominance_batch(tkg_bkg_subtract[is_valid], bin_array = bin_array)
+
+        # the maximum extension (Kb)
+        max_extension[is_valid] = max_ext // 2 * resolution / 1000
+
+        for i, perc_list in zip(np.flatnonzero(is_valid), percent):
+            perc_res_list[i] = list(perc_list)
+
+    return perc_res_list, max_extension
+
+
+def signal_noise_batch(box_sums, max_extension, resolution, offset, coverage_ratio):
+    '''
+    Batched SoN of `calculate_fountain_SoN` from the plumb sums of sampling
+    boxes, within the maximum extension (Kb) of each summit
+
+    Returns
+    -------
+    signal_noise_upstream, signal_noise_downstream and
+    signal_noise_average_background: ndarray objects
+    '''
+    n_layers, is_valid = _summit_layers(max_extension, offset, resolution)
+    box_sums = np.nan_to_num(box_sums, nan=0)
+    is_valid &= _box_coverage(box_sums, n_layers, coverage_ratio)
+
+    # center, upstream, downstream and average background
+    box_sums = np.concatenate(
+        [box_sums, (box_sums[:, 1:2] + box_sums[:, 2:3]) / 2], axis=1
+    )
+    plumb_val_sum = np.cumsum(box_sums, axis=2)
+    plumb_val_sum = plumb_val_sum[np.arange(len(box_sums)), :, n_layers - 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal_noise_ratio = plumb_val_sum[:, :1] / plumb_val_sum[:, 1:]
+
+    # ratio should not be inf
+    signal_noise_ratio[np.isinf(signal_noise_ratio)] = np.nan
+    signal_noise_ratio[~is_valid] = np.nan
+
+    return signal_noise_ratio[:, 0], signal_noise_ratio[:, 1], signal_noise_ratio[:, 2]
+
+
+def ks_test_batch(box_sums, max_extension, resolution, offset, coverage_ratio):
+    '''
+    Batched K-S test of `make_ks_test` from the plumb sums of sampling boxes,
+    within the maximum extension (Kb) of each summit
+
+    Returns
+    -------
+    p_values: ndarray object
+    '''
+    n_layers, is_valid = _summit_layers(max_extension, offset, resolution)
+    box_sums = np.nan_to_num(box_sums, nan=0)
+    is_valid &= _box_coverage(box_sums, n_layers, coverage_ratio)
+
+    bkg_ave = (box_sums[:, 1] + box_sums[:, 2]) / 2
+
+    p_values = np.full(len(box_sums), np.nan)
+    p_values[is_valid] = ks_2samp_batch(
+        box_sums[is_valid, 0], n_layers[is_valid],
+        bkg_ave[is_valid], n_layers[is_valid]
+    )
+
+    return p_values
+
+
+def sort_by_chrom(regions):
+    '''
+    Regions sorted by chromosome name, in their order within a chromosome
+
+    Notes:
+    `merge_fountains` depends on the row order, the sort is stable so
+    that find-fountains and run give the same fountains for the same
+    summits.
+    '''
+    return regions.sort_values(by = 'chrom', kind = 'stable').reset_index(drop = True)
+
+
+def iter_chrom_summits(regions, resolution):
+    '''
+    Positions and init bins of summits for each chromosome
+    '''
+    init_bins = (regions['end'].values + regions['start'].values) // resolution // 2
+
+    for chrom, idx in regions.groupby('chrom', sort = False).indices.items():
+        yield chrom[3:], idx, init_bins[idx]
+
+
+def max_evaluated_length(max_extension, offset):
+    '''
+    The longest extension (bp) of summits which can be evaluated
+    '''
+    extension_length = np.asarray(max_extension, dtype=np.float64) * 1000
+    extension_length = extension_length[
+        ~np.isnan(extension_length) & (offset < extension_length)
+    ]
+
+    return extension_length.max() if len(extension_length) > 0 else None
+
+
 def calculate_fountain_SoN(
     clr, regions, half_width,
-    coverage_ratio, norm, offset
+    coverage_ratio, norm, offset,
+    cache_dir = None, cache_size = 0
 ):
 
     regions = regions.copy()
-    regions = regions.sort_values(by = 'chrom').reset_index(drop = True)
+    regions = sort_by_chrom(regions)
 
     if not set(
         ['chrom', 'start', 'end', 'max_extension']
@@ -171,158 +448,226 @@ def calculate_fountain_SoN(
         )
 
     resolution = clr.binsize
-    chrom_list = []
-    upstream_signal_noise_ratio_list = []
-    downstream_signal_noise_ratio_list = []
-    ave_bkg_signal_noise_ratio_list = []
+    signal_noise_ratio = np.full((3, len(regions)), np.nan)
 
-    for index, row in regions.iterrows():
+    for chrom, idx, init_bins in iter_chrom_summits(regions, resolution):
+        max_extension = regions['max_extension'].values[idx]
+        extension_length = max_evaluated_length(max_extension, offset)
+        if extension_length is None:
+            continue
 
-        chrom = row['chrom'][3:]
-        init_bin = (row['end'] + row['start']) // resolution // 2
-        # 20230411 revise
-        extension_length = row['max_extension'] * 1000
+        mat = fetch_band(
+            clr, chrom, norm, extension_length,
+            cache_dir = cache_dir, cache_size = cache_size
+        )
+        box_sums = sampling_box_plumb_sum(
+            mat, half_width, extension_length, init_bins, resolution, offset
+        )
 
-        if np.isnan(extension_length) or \
-                offset >= extension_length:
-            tkg_plumb, up_bkg, down_bkg = np.nan, np.nan, np.nan
+        signal_noise_ratio[:, idx] = signal_noise_batch(
+            box_sums, max_extension, resolution, offset, coverage_ratio
+        )
 
-        else:
+    regions['signal_noise_upstream'] = signal_noise_ratio[0]
+    regions['signal_noise_downstream'] = signal_noise_ratio[1]
+    regions['signal_noise_average_background'] = signal_noise_ratio[2]
 
-            if not chrom in chrom_list:
-                chrom_list.append(chrom)
-                mat = clr.matrix(balance = norm).fetch(chrom)
+    return regions
 
-            tkg_plumb, up_bkg, down_bkg = set_sampling_box(
-                mat=mat, half_width=half_width,
-                extension_length=extension_length, offset=offset,
-                init_bin=init_bin, resolution=resolution, coverage_ratio=coverage_ratio
-            )
+def plumb(
+    clr, half_width, extension_length, norm,
+    regions, bin_array, offset, coverage_ratio,
+    interval_length = 50000, threshold = 0.5,
+    cache_dir = None, cache_size = 0
+):
 
-        # calculate median interaction in fountain and its signal-over-noise
-        # for central area and background areas
-        if np.all(
-            [isinstance(i, np.ndarray) for i in [up_bkg, down_bkg, tkg_plumb]]
-        ):
-            bkg_ave = np.nanmean(
-                [up_bkg, down_bkg], axis=0
-            )
+    regions = regions.copy()
+    regions = sort_by_chrom(regions)
 
-            tkg_plumb_sum = np.nansum(tkg_plumb)
-            bkg_ave_sum = np.nansum(bkg_ave)
-            bkg_upstream_sum = np.nansum(up_bkg)
-            bkg_downstream_sum = np.nansum(down_bkg)
+    if not set(['chrom', 'start', 'end']).issubset(regions.columns):
+        raise TypeError('Invalid dataframe')
 
-            # calculate signal-noise ratio for average background
-            signal_background_ratio = tkg_plumb_sum / bkg_ave_sum
+    resolution = clr.binsize
+    perc_res_list = [None] * len(regions)
+    max_ext_list = np.full(len(regions), np.nan)
 
-            # calculate signal-noise ratio for upstream background
-            signal_upstream_background_ratio = tkg_plumb_sum / bkg_upstream_sum
+    for chrom, idx, init_bins in iter_chrom_summits(regions, resolution):
+        mat = fetch_band(
+            clr, chrom, norm, extension_length,
+            cache_dir = cache_dir, cache_size = cache_size
+        )
+        box_sums = sampling_box_plumb_sum(
+            mat, half_width, extension_length, init_bins, resolution, offset
+        )
 
-            # calculate signal-noise ratio for downstream background
-            signal_downstream_background_ratio = tkg_plumb_sum / bkg_downstream_sum
+        perc_list, max_ext_list[idx] = extension_batch(
+            box_sums, extension_length = extension_length, resolution = resolution,
+            offset = offset, bin_array = bin_array, coverage_ratio = coverage_ratio,
+            interval_length = interval_length, threshold = threshold
+        )
+        for i, perc in zip(idx, perc_list):
+            perc_res_list[i] = perc
 
-            # ratio should not be inf
-            if np.isinf(signal_background_ratio):
-                signal_background_ratio = np.nan
+    regions['perc_res_list'] = perc_res_list
+    regions['max_extension'] = max_ext_list
 
-            if np.isinf(signal_upstream_background_ratio):
-                signal_upstream_background_ratio = np.nan
+    return regions
 
-            if np.isinf(signal_downstream_background_ratio):
-                signal_downstream_background_ratio = np.nan
 
+def summit_plumb_length(extension_length, interval_length, resolution):
+    '''
+    Extension length (bp) of the sampling boxes needed by `evaluate_summits`
 
-            # calculate median of interactions of fountain
-            #tkg_plumb_median = np.nanmedian(tkg_plumb_sum)
-            # revised 20230411
-            tkg_plumb_median = np.nanmedian(tkg_plumb)
+    Notes:
+    The maximum extension can reach the half of the sliding sheet
+    if no end is found (see `find_maximum_extension`).
+    '''
+    return max(
+        extension_length, (interval_length // resolution - 1) * resolution
+    )
 
-        else:
-            tkg_plumb_sum = np.nan
-            signal_background_ratio = np.nan
-            signal_upstream_background_ratio = np.nan
-            signal_downstream_background_ratio = np.nan
-            tkg_plumb_median = np.nan
 
-        upstream_signal_noise_ratio_list.append(
-            signal_upstream_background_ratio
-        )
+def evaluate_chrom_summits(
+    mat, init_bins, half_width, extension_length,
+    bin_array, offset, coverage_ratio, resolution,
+    interval_length = 50000, threshold = 0.5
+):
+    '''
+    `evaluate_summits` for the init bins of summits of one chromosome
+
+    Parameters
+    ----------
+    mat: BandMatrix object
+        matrix of the chromosome, its band should cover `summit_plumb_length`
+
+    Returns
+    -------
+    perc_res_list: list object
+        dominance at each pixel of `bin_array` for each summit
+
+    res_arr: ndarray object
+        array of shape (5, len(init_bins)), "max_extension",
+        "signal_noise_upstream", "signal_noise_downstream",
+        "signal_noise_average_background" and "p_value" of each summit
+    '''
+    plumb_length = summit_plumb_length(extension_length, interval_length, resolution)
+    box_sums = sampling_box_plumb_sum(
+        mat, half_width, plumb_length, init_bins, resolution, offset
+    )
 
-        downstream_signal_noise_ratio_list.append(
-            signal_downstream_background_ratio
-        )
+    perc_res_list, max_extension = extension_batch(
+        box_sums, extension_length = extension_length, resolution = resolution,
+        offset = offset, bin_array = bin_array, coverage_ratio = coverage_ratio,
+        interval_length = interval_length, threshold = threshold
+    )
 
-        ave_bkg_signal_noise_ratio_list.append(
-            signal_background_ratio
-        )
+    res_arr = np.empty((5, len(init_bins)))
+    res_arr[0] = max_extension
+    res_arr[1:4] = signal_noise_batch(
+        box_sums, max_extension, resolution, offset, coverage_ratio
+    )
+    res_arr[4] = ks_test_batch(
+        box_sums, max_extension, resolution, offset, coverage_ratio
+    )
 
+    return perc_res_list, res_arr
 
-    regions['signal_noise_upstream'] = upstream_signal_noise_ratio_list
-    regions['signal_noise_downstream'] = downstream_signal_noise_ratio_list
-    regions['signal_noise_average_background'] = ave_bkg_signal_noise_ratio_list
 
+def evaluation_checkpoint_key(
+    clr, chrom, init_bins, half_width, extension_length, norm,
+    bin_array, offset, coverage_ratio, interval_length, threshold
+):
+    '''
+    Checkpoint key of `evaluate_chrom_summits` for the summits of a chromosome
+    '''
+    return checkpoint_key(
+        clr, 'evaluation', chrom, init_bins = init_bins, half_width = half_width,
+        extension_length = extension_length, norm = norm, bin_array = bin_array,
+        offset = offset, coverage_ratio = coverage_ratio,
+        interval_length = interval_length, threshold = threshold
+    )
 
-    return regions
 
-def plumb(
-    clr, half_width, extension_length, norm,
-    regions, bin_array, offset, coverage_ratio,
-    interval_length = 50000, threshold = 0.5
+def evaluate_summits(
+    clr, regions, half_width, extension_length, norm,
+    bin_array, offset, coverage_ratio,
+    interval_length = 50000, threshold = 0.5,
+    cache_dir = None, cache_size = 0, checkpoint_dir = None
 ):
+    '''
+    Single-pass evaluation of summits, the results are the same as
+    `plumb`, `calculate_fountain_SoN` and `make_ks_test` in a row.
+
+    Notes:
+    Each chromosome is fetched once, and the plumb sums of the sampling boxes
+    of all its summits are calculated at once, the boxes used for SoN and
+    K-S test are the first layers of the ones used to determine the extension.
+
+    With `checkpoint_dir`, the results of each chromosome are recorded
+    (see `lib.checkpoint`), and the chromosomes whose record matches the
+    cooler, summits and parameters are not evaluated again.
+
+    Returns
+    -------
+    regions: DataFrame object
+        regions with columns "perc_res_list", "max_extension",
+        "signal_noise_upstream", "signal_noise_downstream",
+        "signal_noise_average_background" and "p_value"
+    '''
 
     regions = regions.copy()
-    regions = regions.sort_values(by = 'chrom').reset_index(drop = True)
+    regions = sort_by_chrom(regions)
 
     if not set(['chrom', 'start', 'end']).issubset(regions.columns):
         raise TypeError('Invalid dataframe')
 
     resolution = clr.binsize
-    chrom_list = []
-    perc_res_list = []
-    max_ext_list = []
-
-    for index, row in regions.iterrows():
-        chrom = row['chrom'][3:]
-        init_bin = (row['end'] + row['start']) // resolution // 2
-
-        if not chrom in chrom_list:
-            chrom_list.append(chrom)
-            mat = clr.matrix(balance=norm).fetch(chrom)
-
-        max_ext, perc_list = center_background_plumb(
-            mat = mat, half_width=half_width,
-            extension_length=extension_length, init_bin=init_bin,
-            offset = offset, coverage_ratio = coverage_ratio, resolution=resolution,
-            bin_array = bin_array, interval_length=interval_length, threshold = threshold
-        )
-
-        try:
-            perc_list = list(perc_list)
-        except:
-            perc_list = list(np.zeros_like(bin_array))
+    plumb_length = summit_plumb_length(extension_length, interval_length, resolution)
 
-        perc_res_list.append(perc_list)
+    perc_res_list = [None] * len(regions)
+    res_arr = np.full((5, len(regions)), np.nan)
 
-        if not np.isnan(max_ext):
+    for chrom, idx, init_bins in iter_chrom_summits(regions, resolution):
+        result = None
+        if checkpoint_dir is not None:
+            key = evaluation_checkpoint_key(
+                clr, chrom, init_bins, half_width, extension_length, norm,
+                bin_array, offset, coverage_ratio, interval_length, threshold
+            )
+            result = load_checkpoint(checkpoint_dir, 'evaluation', chrom, key)
 
-        # append the maximum extension(Kb) to dataframe
-            max_ext_length = max_ext // 2 * resolution / 1000
+        if result is None:
+            mat = fetch_band(
+                clr, chrom, norm, plumb_length,
+                cache_dir = cache_dir, cache_size = cache_size
+            )
+            result = evaluate_chrom_summits(
+                mat, init_bins, half_width, extension_length,
+                bin_array, offset, coverage_ratio, resolution,
+                interval_length = interval_length, threshold = threshold
+            )
 
-        else:
-            max_ext_length = np.nan
+            if checkpoint_dir is not None:
+                save_checkpoint(checkpoint_dir, 'evaluation', chrom, key, result)
 
-        max_ext_list.append(max_ext_length)
+        perc_list, res_arr[:, idx] = result
+        for i, perc in zip(idx, perc_list):
+            perc_res_list[i] = perc
 
     regions['perc_res_list'] = perc_res_list
-    regions['max_extension'] = max_ext_list
+    regions['max_extension'] = res_arr[0]
+    regions['signal_noise_upstream'] = res_arr[1]
+    regions['signal_noise_downstream'] = res_arr[2]
+    regions['signal_noise_average_background'] = res_arr[3]
+    regions['p_value'] = res_arr[4]
 
     return regions
 
 
 def background_evaluation(
     clr, background_clr, feature, extension_length,
-    half_width, offset, norm = 'VC_SQRT'
+    half_width, offset, norm = 'VC_SQRT',
+    cache_dir = None, cache_size = 0
 ):
     """
     Compare interactions between Repli-HiC and BL-HiC and
@@ -337,7 +682,7 @@ def background_evaluation(
     if not feature.columns.isin(columns).any():
         feature.columns = columns
 
-    feature = feature.sort_values(by = 'chrom').reset_index(drop = True)
+    feature = sort_by_chrom(feature)
     # get resolution
     assert clr.binsize == background_clr.binsize, 'Unmatched resolution'
     resolution = clr.binsize
@@ -348,52 +693,51 @@ def background_evaluation(
         if feature.chrom.str.contains('chr').all():
             feature.loc[:, 'chrom'] = [i[3:] for i in feature.chrom]
 
-    chrom_list = []
-    val_list = []
-    pos_ratio_list = []
-    neg_ratio_list = []
-    for index, row in feature.iterrows():
-        chrom = row['chrom']
-        init_bin = (row['end'] + row['start']) // resolution // 2
-
-        if not chrom in chrom_list:
-            chrom_list.append(chrom)
-            mat = clr.matrix(balance=norm).fetch(chrom)
-            background_mat = background_clr.matrix(balance=norm).fetch(chrom)
-            mat_subtraction = mat - background_mat
-
-        try:
-            extension_length = row['max_extension'] * 1000
-        except Exception as e:
-            extension_length = extension_length
-
-        target_plumb_val = np.asarray(
-            [i for i in plumb_sum(
-                mat = mat_subtraction,
-                half_width = half_width,
-                init_bin = init_bin, extension_length = extension_length,
-                resolution = resolution, offset = offset
-            )]
-        )
+    if 'max_extension' in feature.columns:
+        extension_list = feature['max_extension'].values * 1000
+    else:
+        extension_list = np.full(len(feature), extension_length)
+
+    if np.isnan(extension_list).any():
+        raise ValueError('nan extension length')
+
+    init_bins = (feature['end'].values + feature['start'].values) // resolution // 2
+    pos_ratio_list = np.empty(len(feature))
+    neg_ratio_list = np.empty(len(feature))
 
-        positive_value = target_plumb_val[target_plumb_val>0]
-        positive_value_ratio = len(positive_value) / len(target_plumb_val)
+    for chrom, idx in feature.groupby('chrom', sort = False).indices.items():
+        ext_length = int(extension_list[idx].max())
 
-        negative_value = target_plumb_val[target_plumb_val<=0]
-        negative_value_ratio = len(negative_value) / len(target_plumb_val)
+        mat = fetch_band(
+            clr, chrom, norm, ext_length,
+            cache_dir = cache_dir, cache_size = cache_size
+        )
+        background_mat = fetch_band(
+            background_clr, chrom, norm, ext_length,
+            cache_dir = cache_dir, cache_size = cache_size
+        )
+        mat_subtraction = BandMatrix(mat.band - background_mat.band, n_bins = mat.n_bins)
+        del mat, background_mat
 
+        cum_sum, cum_cnt = mat_subtraction.prefix_sums()
+        layer_sums = plumb_sums_prefix(
+            cum_sum, cum_cnt, 0, half_width, init_bins[idx],
+            ext_length, mat_subtraction.n_bins, offset, resolution
+        )
 
-        if len(positive_value) > len(negative_value):
-            val_list.append(True)
-        else:
-            val_list.append(False)
+        # each summit only uses the layers within its own extension
+        n_layers = np.array([
+            n_plumb_layers(i, offset, resolution) for i in extension_list[idx]
+        ])
+        assert (n_layers > 0).all(), \
+            'The offset should not exceed length of extension'
 
-        pos_ratio_list.append(positive_value_ratio)
-        neg_ratio_list.append(negative_value_ratio)
+        within = np.arange(layer_sums.shape[1]) < n_layers[:, None]
+        pos_ratio_list[idx] = ((layer_sums > 0) & within).sum(axis = 1) / n_layers
+        neg_ratio_list[idx] = ((layer_sums <= 0) & within).sum(axis = 1) / n_layers
 
     feature.loc[:, 'pos_ratio'] = pos_ratio_list
     feature.loc[:, 'neg_ratio'] = neg_ratio_list
-    feature.loc[:, 'subtraction_value'] = val_list
+    feature.loc[:, 'subtraction_value'] = pos_ratio_list > neg_ratio_list
 
     return feature
-
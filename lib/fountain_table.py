@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from .util import load_npz_mmap
+
+
+def perc_res_array(perc_res_list, dtype = np.float32):
+    '''
+    Dominance profiles as a fixed-width 2-D array
+
+    Parameters
+    ----------
+    perc_res_list: list object
+        dominance at each pixel of `bin_array` for each summit,
+        see `extension_batch`
+
+    Returns
+    -------
+    perc_res: ndarray object
+        array of shape (n_summits, max length of profiles), the profiles
+        are left-aligned and padded with NaNs
+
+    lengths: ndarray object
+        length of each profile
+    '''
+    lengths = np.asarray([len(i) for i in perc_res_list], dtype=np.int64)
+    perc_res = np.full((len(lengths), lengths.max(initial=0)), np.nan, dtype=dtype)
+
+    for i, perc in enumerate(perc_res_list):
+        perc_res[i, :lengths[i]] = perc
+
+    return perc_res, lengths
+
+
+def save_fountain_table(path, regions, dtype = np.float32, attrs = None):
+    '''
+    Write fountains as an uncompressed .npz bundle of columns
+
+    Parameters
+    ----------
+    path: str or file object
+
+    regions: DataFrame object
+        fountains, or evaluated summits, with a "perc_res_list" column
+
+    dtype: numpy dtype
+        dtype of the dominance profiles, float64 keeps them exact
+
+    attrs: dict object
+        scalars or 1-D arrays stored along with the columns, e.g. the
+        parameters of the evaluation (see `load_fountain_attrs`)
+
+    Notes:
+    "perc_res_list" is stored as the 2-D array "perc_res" with the
+    lengths of profiles, string columns as fixed-width unicode arrays, so
+    that `load_fountain_table` can memory-map every column.
+    '''
+    columns = {}
+    for column in regions.columns:
+        if column == 'perc_res_list':
+            columns['perc_res'], columns['perc_res_length'] = \
+                perc_res_array(regions[column].values, dtype=dtype)
+
+        elif regions[column].dtype == object:
+            columns[column] = regions[column].values.astype(str)
+
+        else:
+            columns[column] = regions[column].values
+
+    columns['columns'] = np.asarray(regions.columns, dtype=str)
+
+    attrs = {} if attrs is None else attrs
+    for name, value in attrs.items():
+        columns[f'attr_{name}'] = np.asarray(value)
+    columns['attrs'] = np.asarray(list(attrs), dtype=str)
+
+    np.savez(path, **columns)
+
+
+def load_fountain_table(path):
+    '''
+    Load fountains written by `save_fountain_table`
+
+    Returns
+    -------
+    regions: DataFrame object
+        the scalar columns
+
+    perc_res: memmap object
+        read-only array of dominance profiles, one row per fountain,
+        padded with NaNs (see `perc_res_array`)
+    '''
+    arrays = load_npz_mmap(path)
+
+    regions = pd.DataFrame({
+        column: arrays[column] for column in arrays['columns']
+        if column != 'perc_res_list'
+    })
+
+    return regions, arrays['perc_res']
+
+
+def load_fountain_dataframe(path):
+    '''
+    Load fountains written by `save_fountain_table` as the DataFrame
+    they were written from
+
+    Returns
+    -------
+    regions: DataFrame object
+        all columns in their order, "perc_res_list" as lists of the
+        dominance of each fountain
+    '''
+    arrays = load_npz_mmap(path)
+
+    columns = {}
+    for column in arrays['columns']:
+        if column == 'perc_res_list':
+            perc_res = np.asarray(arrays['perc_res'])
+            columns[column] = [
+                list(perc[:length])
+                for perc, length in zip(perc_res, arrays['perc_res_length'])
+            ]
+        else:
+            columns[column] = np.asarray(arrays[column])
+
+    return pd.DataFrame(columns)
+
+
+def load_fountain_attrs(path):
+    '''
+    Attributes stored by `save_fountain_table`, as a dict
+    '''
+    arrays = load_npz_mmap(path)
+
+    return {
+        name: np.asarray(arrays[f'attr_{name}']).tolist()
+        for name in arrays.get('attrs', ())
+    }
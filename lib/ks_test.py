@@ -30,7 +30,10 @@ def ks_test(mat, half_width, mid, extension_length, coverage_ratio, resolution,
         return np.nan
 
 # make offset = 0
-def make_ks_test(clr, regions, half_width, norm, coverage_ratio, offset, use_control=True):
+def make_ks_test(
+    clr, regions, half_width, norm, coverage_ratio, offset,
+    use_control=True, cache_dir=None, cache_size=0
+):
     '''
     for each of candidate fountain, we use Kolmogorov–Smirnov test to verify its credibility
 
@@ -53,39 +56,26 @@ def make_ks_test(clr, regions, half_width, norm, coverage_ratio, offset, use_con
             'Invalid dataframe, you have to calculate the length of extension'
         )
 
-    chrom_list = []
-    ks_res_list = []
-    for index, row in regions.iterrows():
-        chrom = row['chrom'][3:]
-        mid = (row['end'] + row['start']) // resolution // 2
-        extension_length = row['max_extension'] * 1000
+    p_values = np.full(len(regions), np.nan)
 
-        if np.isnan(extension_length) or offset >= extension_length:
-            ks_res = np.nan
+    for chrom, idx, init_bins in iter_chrom_summits(regions, resolution):
+        max_extension = regions['max_extension'].values[idx]
+        extension_length = max_evaluated_length(max_extension, offset)
+        if extension_length is None:
+            continue
 
-        else:
-            if chrom in chrom_list:
-
-                    ks_res = ks_test(
-                        mat=mat, half_width=half_width, mid=mid, extension_length=extension_length,
-                        coverage_ratio=coverage_ratio, resolution=resolution, offset=offset
-                    )
-
-            else:
-                chrom_list.append(chrom)
-                mat = clr.matrix(balance = norm).fetch(chrom)
-
-                ks_res = ks_test(
-                    mat=mat, half_width=half_width, mid=mid, extension_length=extension_length,
-                    coverage_ratio=coverage_ratio, resolution=resolution, offset=offset
-                )
+        mat = fetch_band(
+            clr, chrom, norm, extension_length,
+            cache_dir=cache_dir, cache_size=cache_size
+        )
+        box_sums = sampling_box_plumb_sum(
+            mat, half_width, extension_length, init_bins, resolution, offset
+        )
 
-        ks_res_list.append(ks_res)
+        p_values[idx] = ks_test_batch(
+            box_sums, max_extension, resolution, offset, coverage_ratio
+        )
 
-    regions['p_value'] = [
-        i.pvalue if isinstance(
-            i, scipy.stats._stats_py.KstestResult
-        ) else np.nan for i in ks_res_list
-    ]
+    regions['p_value'] = p_values
 
     return regions
@@ -1,48 +1,149 @@
+import numba
 import numpy as np
+import pandas as pd
 
-def merge_fountains(regions, max_distance = 50000):
 
-    regions = regions.copy()
+@numba.jit(nopython=True)
+def _is_better(score, pos, i, j):
+    """Whether fountain i wins over j as `np.argmax` in frame order, NaN wins."""
+    if np.isnan(score[i]):
+        return not np.isnan(score[j]) or pos[i] < pos[j]
+    if np.isnan(score[j]):
+        return False
+
+    return score[i] > score[j] or (score[i] == score[j] and pos[i] < pos[j])
+
+
+@numba.jit(nopython=True)
+def _window_kernel(key, score, pos, max_distance):
+    """Size, best fountain and first fountain (in frame order) of the window
+    of each fountain, the fountains are sorted by `key` and the windows
+    [key - max_distance, key + max_distance] slide with monotonic deques."""
+    n = len(key)
+    size = np.empty(n, dtype=np.int64)
+    best = np.empty(n, dtype=np.int64)
+    first = np.empty(n, dtype=np.int64)
+
+    best_deque = np.empty(n, dtype=np.int64)
+    first_deque = np.empty(n, dtype=np.int64)
+    best_head, best_tail, first_head, first_tail = 0, 0, 0, 0
+    lo, hi = 0, 0
+
+    for i in range(n):
+        while hi < n and key[hi] <= key[i] + max_distance:
+            while best_tail > best_head and \
+                    not _is_better(score, pos, best_deque[best_tail - 1], hi):
+                best_tail -= 1
+            best_deque[best_tail] = hi
+            best_tail += 1
+
+            while first_tail > first_head and pos[first_deque[first_tail - 1]] > pos[hi]:
+                first_tail -= 1
+            first_deque[first_tail] = hi
+            first_tail += 1
+            hi += 1
+
+        while key[lo] < key[i] - max_distance:
+            lo += 1
+        while best_deque[best_head] < lo:
+            best_head += 1
+        while first_deque[first_head] < lo:
+            first_head += 1
+
+        size[i] = hi - lo
+        best[i] = pos[best_deque[best_head]]
+        first[i] = pos[first_deque[first_head]]
+
+    return size, best, first
 
-    # chrom list
-    chroms = regions['chrom'].unique()
-    # list of dataframe index for storing the best fountain candidates
-    unique_index_list = []
 
-    for chrom in chroms:
-        df = regions[regions['chrom'] == chrom]
-        df_starts = np.asarray(df['start'], dtype = int)
+@numba.jit(nopython=True)
+def _merge_kernel(order, key, size, best, first, max_distance):
+    """Selected fountains, visited in frame order grouped by chromosome.
+    The best fountain of a window is kept unless already kept, and replaces
+    the last kept fountain when the latter lies in the window."""
+    n = len(order)
+    kept = np.empty(n + 1, dtype=np.int64)
+    n_kept = 0
+    counts = np.zeros(n, dtype=np.int64)
 
-        upstream_bound = df_starts - max_distance
-        downstream_bound = df_starts + max_distance
+    for i in order:
+        if size[i] == 1:
+            kept[n_kept] = i
+            n_kept += 1
+            counts[i] += 1
+            continue
 
-        for up, down in zip(upstream_bound, downstream_bound):
-            df_overlap = df[
-                (df['start'] >= up) & (df['start'] <= down)
-            ]
+        if counts[best[i]] > 0:
+            continue
+
+        if n_kept == 0:
+            kept[n_kept] = first[i]
+            n_kept += 1
+            counts[first[i]] += 1
+        elif abs(key[kept[n_kept - 1]] - key[i]) <= max_distance:
+            n_kept -= 1
+            counts[kept[n_kept]] -= 1
+
+        kept[n_kept] = best[i]
+        n_kept += 1
+        counts[best[i]] += 1
+
+    return kept[:n_kept]
+
+
+def merge_fountains(regions, max_distance = 50000):
+    '''
+    Merge the fountains close to each other, keep the one with the highest
+    "signal_noise_average_background"
+
+    Parameters
+    ----------
+    regions: DataFrame object
+        fountains with columns "chrom", "start" and
+        "signal_noise_average_background"
+
+    max_distance: int object
+        fountains whose starts are within this distance (bp) are merged
+
+    Returns
+    -------
+    regions: DataFrame object
+        merged fountains
+
+    Notes:
+    Each fountain is visited in turn (chromosome by chromosome, in order of
+    appearance), the window of fountains within `max_distance` of it elects
+    its best one, which replaces the last kept fountain if the latter is in
+    the window. The windows of all chromosomes are found at once by sorting
+    the starts, so merging is O(n log n) instead of scanning the DataFrame
+    for every fountain.
+    '''
+    regions = regions.copy()
 
-            # record the dataframe index for the best fountain candidate
-            if len(df_overlap) > 1:
-                df_overlap_score = df_overlap['signal_noise_average_background'].values
-                df_overlap_row_index = list(df_overlap.index)
+    if len(regions) == 0:
+        return regions
 
-                max_idx = np.argmax(df_overlap_score)
-                df_max_idx = df_overlap.iloc[max_idx].name
+    codes, _ = pd.factorize(regions['chrom'])
+    starts = np.asarray(regions['start'], dtype = int)
+    scores = np.asarray(regions['signal_noise_average_background'], dtype = np.float64)
 
-                # if the max index has been stored in the list
-                if not df_max_idx in unique_index_list:
+    # chromosomes are spaced so that no window spans two of them
+    span = starts.max() - starts.min() + 2 * max_distance + 1
+    key = codes.astype(np.int64) * span + starts
 
-                    try:
-                        if unique_index_list[-1] in df_overlap_row_index:
-                            unique_index_list.pop()
-                    except IndexError:
-                        unique_index_list.append(df_overlap.index[0])
+    sorted_idx = np.argsort(key, kind = 'stable')
+    inverse = np.empty_like(sorted_idx)
+    inverse[sorted_idx] = np.arange(len(sorted_idx))
 
-                    unique_index_list.append(df_max_idx)
+    size, best, first = (
+        i[inverse] for i in _window_kernel(
+            key[sorted_idx], scores[sorted_idx], sorted_idx, max_distance
+        )
+    )
 
-            else:
-                # if this fountain is unique in this region,
-                # just record the index of this line
-                unique_index_list.append(df_overlap.index[0])
+    kept = _merge_kernel(
+        np.argsort(codes, kind = 'stable'), key, size, best, first, max_distance
+    )
 
-    return regions.iloc[unique_index_list]
\ No newline at end of file
+    return regions.iloc[kept]
@@ -1,10 +1,26 @@
 import numpy as np
 
+from .fountain_table import perc_res_array
+
+
 def filter_extension(region_file, threshold=0.6):
-    ext_list = region_file['perc_res_list']
+    '''
+    Whether the dominance of each fountain exceeds `threshold` at any pixel
 
-    func = lambda x: len(x[x > threshold]) >= 1
+    Parameters
+    ----------
+    region_file: DataFrame or ndarray object
+        fountains with column "perc_res_list", or their dominance profiles
+        as a 2-D array (see `load_fountain_table`)
 
-    bool_list = [func(np.asarray(i)) for i in ext_list]
+    Returns
+    -------
+    bool_list: ndarray object
+    '''
+    if isinstance(region_file, np.ndarray):
+        perc_res = region_file
+    else:
+        perc_res, _ = perc_res_array(region_file['perc_res_list'], dtype=np.float64)
 
-    return bool_list
\ No newline at end of file
+    # padded NaNs are never above the threshold
+    return (perc_res > perc_res.dtype.type(threshold)).any(axis=1)
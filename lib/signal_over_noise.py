@@ -1,6 +1,7 @@
 from multiprocessing import Pool
-from scipy.stats import ks_2samp
+from scipy.stats import ks_2samp, kstwo
 from .diagonal_plumb import *
+import numba
 import pandas as pd
 import numpy as np
 import cooler
@@ -38,6 +39,143 @@ def ks_test(mat, half_width, mid, extension_length, offset, coverage_ratio, reso
         return np.nan
 
 
+
+# sample sizes up to which the p-value is exact, as `ks_2samp(method='auto')`
+MAX_AUTO_N = 10000
+
+@numba.jit(nopython=True)
+def _prob_outside_square(n, h):
+    '''
+    Pr(D_{n,n} >= h/n), same as `scipy.stats._stats_py._compute_prob_outside_square`
+    '''
+    P = 0.0
+    k = int(np.floor(n / h))
+    while k >= 0:
+        p1 = 1.0
+        for j in range(h):
+            p1 = (n - k * h - j) * p1 / (n + k * h + j + 1)
+        P = p1 * (1.0 - P)
+        k -= 1
+    return 2 * P
+
+
+@numba.jit(nopython=True, nogil=True)
+def ks_2samp_kernel(data1, n1, data2, n2):
+    '''
+    Compiled two-sided two-sample K-S statistic for each row
+
+    Notes:
+    The statistic is the largest difference of the empirical distributions,
+    obtained by a merge of the two sorted samples. The exact p-value is only
+    computed for samples of the same size, which is the case of sampling boxes.
+
+    Returns
+    -------
+    d: ndarray object
+        K-S statistic of each row
+
+    prob: ndarray object
+        exact p-value, NaN if it has to be computed otherwise
+
+    method: ndarray object
+        0 for exact, 1 for asymptotic and 2 for the rows with samples of
+        different sizes, -1 for empty samples
+    '''
+    n_rows = len(n1)
+    d = np.full(n_rows, np.nan)
+    prob = np.full(n_rows, np.nan)
+    method = np.full(n_rows, -1, dtype=np.int64)
+
+    for row in range(n_rows):
+        m, n = n1[row], n2[row]
+        if min(m, n) == 0:
+            continue
+
+        x = np.sort(data1[row, :m])
+        y = np.sort(data2[row, :n])
+
+        # cdf1 - cdf2 at each value of both samples
+        max_s, min_s = -np.inf, np.inf
+        i, j = 0, 0
+        while i < m or j < n:
+            if j == n or (i < m and x[i] <= y[j]):
+                val = x[i]
+            else:
+                val = y[j]
+
+            while i < m and x[i] <= val:
+                i += 1
+            while j < n and y[j] <= val:
+                j += 1
+
+            diff = i / m - j / n
+            max_s = max(max_s, diff)
+            min_s = min(min_s, diff)
+
+        min_s = min(max(-min_s, 0.0), 1.0)
+        d[row] = min_s if min_s > max_s else max_s
+
+        if max(m, n) > MAX_AUTO_N:
+            method[row] = 1
+            continue
+
+        if m != n:
+            method[row] = 2
+            continue
+
+        # the lcm of two samples of size n is n
+        h = int(np.round(d[row] * n))
+        d[row] = h / n
+        p = 1.0 if h == 0 else _prob_outside_square(n, h)
+
+        if np.isfinite(p) and 0 <= p <= 1:
+            method[row] = 0
+            prob[row] = p
+        else:
+            method[row] = 1
+
+    return d, prob, method
+
+
+def ks_2samp_batch(data1, n1, data2, n2):
+    '''
+    Two-sided two-sample K-S test for a batch of ragged samples
+
+    Parameters
+    ----------
+    data1, data2: ndarray object
+        2d arrays, only the first n1[i] (n2[i]) values of row i are used
+
+    n1, n2: ndarray object
+        sample sizes of each row
+
+    Returns
+    -------
+    p_values: ndarray object
+        same as `ks_2samp(data1[i, :n1[i]], data2[i, :n2[i]]).pvalue`,
+        NaN for empty samples
+    '''
+    data1 = np.asarray(data1, dtype=np.float64)
+    data2 = np.asarray(data2, dtype=np.float64)
+    n1 = np.asarray(n1, dtype=np.int64)
+    n2 = np.asarray(n2, dtype=np.int64)
+
+    d, p_values, method = ks_2samp_kernel(data1, n1, data2, n2)
+
+    # Smirnov's asymptotic distribution
+    is_asymp = method == 1
+    if is_asymp.any():
+        m = np.maximum(n1[is_asymp], n2[is_asymp]).astype(np.float64)
+        n = np.minimum(n1[is_asymp], n2[is_asymp]).astype(np.float64)
+        en = m * n / (m + n)
+        p_values[is_asymp] = kstwo.sf(d[is_asymp], np.round(en))
+
+    # exact p-value of samples with different sizes
+    for i in np.where(method == 2)[0]:
+        p_values[i] = ks_2samp(data1[i, :n1[i]], data2[i, :n2[i]]).pvalue
+
+    return np.clip(p_values, 0, 1)
+
 def calculate_coverage(plumb_signal):
     '''
     Calculate coverage ratio when perform plumb
@@ -214,14 +352,213 @@ def calculate_signal_noise_ratio_score(
         yield fountain_score
 
 
+def plumb_layer_sum_matrix(
+    mat, half_width, extension_length,
+    resolution, offset, bin_start, bin_end
+):
+    '''
+    Layer sums of the center sampling box for every init bin in
+    [bin_start, bin_end), init bins may exceed the boundary of matrix
+
+    Returns
+    -------
+    layer_sums: ndarray object
+        array of shape (bin_end - bin_start, n_layers)
+    '''
+
+    if isinstance(mat, BandMatrix):
+        check_band_range(mat, half_width, bin_start, bin_end, extension_length, resolution)
+
+        cum_sum, cum_cnt = mat.prefix_sums()
+        return plumb_layer_sums_prefix(
+            cum_sum, cum_cnt, mat.bin_start, half_width, bin_start, bin_end,
+            int(extension_length), mat.shape[0], offset, resolution
+        )
+
+    return np.asarray([
+        [i for i in plumb_sum(
+            mat = mat, half_width = half_width,
+            init_bin = init_bin, extension_length = extension_length,
+            offset = offset, resolution = resolution
+        )] for init_bin in range(bin_start, bin_end)
+    ], dtype=np.float64)
+
+
+@numba.jit(nopython=True, nogil=True)
+def signal_noise_ratio_kernel(layer_sums, shift, coverage_ratio, use_mean):
+    '''
+    Compiled SoN score for all bins from the layer-sum matrix
+
+    Notes:
+    Row idx + shift of `layer_sums` is the center sampling box of bin idx,
+    rows idx and idx + 2*shift are its upstream and downstream backgrounds.
+    The semantics are the same as `calculate_signal_noise_ratio_score`.
+
+    Returns
+    -------
+    fountain score: ndarray object
+        SoN score for each bin of matrix
+    '''
+
+    n_rows, n_layers = layer_sums.shape
+    n_bins = n_rows - 2 * shift
+
+    # the empty layers are counted as 0 (see `calculate_coverage`)
+    filled = np.where(np.isnan(layer_sums), 0.0, layer_sums)
+
+    plumb_val_sum = np.zeros(n_rows, dtype=np.float64)
+    is_covered = np.zeros(n_rows, dtype=np.bool_)
+    for row in range(n_rows):
+        n_nonzero = 0
+        for layer in range(n_layers):
+            plumb_val_sum[row] += filled[row, layer]
+            if filled[row, layer] != 0:
+                n_nonzero += 1
+
+        is_covered[row] = n_nonzero / n_layers > coverage_ratio
+
+    fountain_score = np.full(n_bins, np.nan)
+    for idx in range(n_bins):
+        center = idx + shift
+        if not (is_covered[idx] and is_covered[center] and is_covered[center + shift]):
+            continue
+
+        # gradient for upstream / downstream
+        bkg_ave = (plumb_val_sum[idx] + plumb_val_sum[center + shift]) / 2
+        if bkg_ave != 0:
+            bkg_gradient = plumb_val_sum[center] / bkg_ave
+        else:
+            bkg_gradient = np.nan
+
+        # set np.nan/inf to 1
+        if not np.isfinite(bkg_gradient):
+            bkg_gradient = 1.0
+
+        if use_mean:
+            fountain_score[idx] = plumb_val_sum[center] / n_layers * np.log(bkg_gradient)
+        else:
+            fountain_score[idx] = np.median(filled[center]) * np.log(bkg_gradient)
+
+    return fountain_score
+
+
+def calculate_signal_noise_ratio_track(
+    mat, half_width, extension_length,
+    resolution, offset, coverage_ratio = 0.2,
+    use_mean = True, bin_start = 0, bin_end = None
+):
+    '''
+    Same as `calculate_signal_noise_ratio_score`, but for all bins
+    in [bin_start, bin_end) at once (default is all bins of matrix)
+
+    Notes:
+    The upstream and downstream backgrounds of bin idx are the center
+    sampling boxes of bins idx - 2*half_width - 1 and idx + 2*half_width + 1,
+    so the layer sums are computed once for all init bins and the
+    backgrounds are obtained by shifting the layer-sum matrix.
+
+    Returns
+    -------
+    fountain score: ndarray object
+        SoN score for each bin in [bin_start, bin_end)
+    '''
+
+    if bin_end is None:
+        bin_end = mat.shape[0]
+
+    shift = 2 * half_width + 1
+
+    layer_sums = plumb_layer_sum_matrix(
+        mat=mat, half_width=half_width, extension_length=extension_length,
+        resolution=resolution, offset=offset,
+        bin_start=bin_start - shift, bin_end=bin_end + shift
+    )
+
+    return signal_noise_ratio_kernel(
+        layer_sums, shift, float(coverage_ratio), bool(use_mean)
+    )
+
+
+def slice_layer_sums(layer_sums, extension_length, offset, resolution):
+    '''
+    Layer sums at given extension length and offset from the layer sums
+    computed at a longer extension length without offset
+
+    Notes:
+    The layers of `plumb_numbda` only depend on the previous ones, so a
+    shorter extension is a prefix of the layers. With an offset, the first
+    layer (odd) is empty and the next ones are the same as without offset.
+    '''
+    n_layers = n_plumb_layers(extension_length, 0, resolution)
+    if n_layers > layer_sums.shape[1]:
+        raise ValueError('The extension length exceeds the one of layer sums')
+
+    if offset == 0:
+        return layer_sums[:, :n_layers]
+
+    offset_bins = (offset // resolution) * 2 + 1
+    assert offset_bins < n_layers, \
+        'The offset should not exceed length of extension'
+
+    return np.concatenate([
+        np.full((len(layer_sums), 1), np.nan),
+        layer_sums[:, offset_bins + 1: n_layers]
+    ], axis=1)
+
+
+def calculate_signal_noise_ratio_sweep(
+    mat, half_widths, extension_lengths, offsets,
+    resolution, coverage_ratio = 0.2, use_mean = True
+):
+    '''
+    Same as `calculate_signal_noise_ratio_track` for every combination of
+    half width, extension length and offset
+
+    Notes:
+    For each half width, the layer-sum matrix is computed once at the
+    longest extension length without offset, the other extension lengths
+    and offsets are slices of it (see `slice_layer_sums`). The combinations
+    with an offset exceeding the extension length are skipped.
+
+    Returns
+    -------
+    iterator of ((half_width, extension_length, offset), fountain score)
+    '''
+    max_extension = max(extension_lengths)
+
+    for half_width in half_widths:
+        shift = 2 * half_width + 1
+        layer_sums = plumb_layer_sum_matrix(
+            mat=mat, half_width=half_width, extension_length=max_extension,
+            resolution=resolution, offset=0,
+            bin_start=-shift, bin_end=mat.shape[0] + shift
+        )
+
+        for extension_length in extension_lengths:
+            for offset in offsets:
+                if n_plumb_layers(extension_length, offset, resolution) < 1:
+                    continue
+
+                fountain_score = signal_noise_ratio_kernel(
+                    slice_layer_sums(layer_sums, extension_length, offset, resolution),
+                    shift, float(coverage_ratio), bool(use_mean)
+                )
+
+                yield (half_width, extension_length, offset), fountain_score
+
+# matrix shared by the processes of `calculate_strength_parallel`
+_shared_mat = None
+
+def _init_worker(mat):
+    global _shared_mat
+    _shared_mat = mat
+
 def worker(args):
-    mat, half_width, extension_length, resolution, offset, coverage_ratio, idx = args
+    half_width, extension_length, resolution, offset, coverage_ratio, idx = args
     tkg_plumb = center_area_plumb_sum(
-        mat, half_width, extension_length, idx, offset, resolution, coverage_ratio
+        _shared_mat, half_width, extension_length, idx, offset, resolution, coverage_ratio
     )
 
-    print(f"This is bin {idx}")
-
     if isinstance(tkg_plumb, np.ndarray):
         return np.nansum(tkg_plumb)
     else:
@@ -232,9 +569,10 @@ def calculate_strength_parallel(mat, half_width, extension_length, resolution, o
     print('Calculating parallel......')
     print(f'------Your input CPU is {CPU}------')
 
-    with Pool(CPU) as pool:
-        args_list = [(mat, half_width, extension_length, resolution, offset, coverage_ratio, idx) for idx in range(mat.shape[0])]
-        results = pool.map(worker, args_list)
+    # the matrix is sent once to each process instead of once per bin
+    with Pool(CPU, initializer=_init_worker, initargs=(mat,)) as pool:
+        args_list = [(half_width, extension_length, resolution, offset, coverage_ratio, idx) for idx in range(mat.shape[0])]
+        results = pool.map(worker, args_list, chunksize=max(1, len(args_list) // (4 * CPU)))
     return results
 
 
@@ -0,0 +1,129 @@
+import bioframe
+import numpy as np
+import pandas as pd
+
+from .util import load_npz_mmap
+
+
+def save_son_store(path, SoN_tracks, resolution, chromsizes):
+    '''
+    Write SoN tracks as one fixed-stride float32 array
+
+    Parameters
+    ----------
+    path: str object
+        path of the store, an uncompressed .npz file
+
+    SoN_tracks: dict object
+        SoN scores of each chromosome, one per bin
+
+    resolution: int object
+
+    chromsizes: Series object
+        sizes of the chromosomes, in the order of the store
+
+    Notes:
+    The scores of all chromosomes are concatenated in "values", the scores
+    of a chromosome start at its entry of "offsets", so that bin i of it
+    is values[offsets[chrom] + i]. Chromosomes without track are empty.
+    '''
+    chroms = list(chromsizes.index)
+    lengths = [len(SoN_tracks.get(chrom, ())) for chrom in chroms]
+    offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+    values = np.empty(offsets[-1], dtype=np.float32)
+    for chrom, start, end in zip(chroms, offsets[:-1], offsets[1:]):
+        if end > start:
+            values[start:end] = SoN_tracks[chrom]
+
+    np.savez(
+        path, values=values, offsets=offsets,
+        chroms=np.asarray(chroms, dtype=str),
+        chromsizes=chromsizes.values.astype(np.int64),
+        resolution=np.int64(resolution)
+    )
+
+
+class SoNStore(object):
+    '''
+    Random access to SoN tracks written by `save_son_store`
+
+    The scores are memory-mapped, so that only the queried bins are read.
+
+    Parameters
+    ----------
+    path: str object
+        path of the store
+    '''
+
+    def __init__(self, path):
+        arrays = load_npz_mmap(path)
+
+        self.resolution = int(arrays['resolution'])
+        self.chromsizes = pd.Series(
+            np.asarray(arrays['chromsizes']), index=np.asarray(arrays['chroms'])
+        )
+        self._values = arrays['values']
+
+        # first and last + 1 positions of the bins of each chromosome
+        offsets = np.asarray(arrays['offsets'])
+        self._bins = dict(zip(self.chromsizes.index, zip(offsets[:-1], offsets[1:])))
+
+    @property
+    def chroms(self):
+        return list(self.chromsizes.index)
+
+    def fetch(self, chrom, start = 0, end = None):
+        '''
+        SoN scores of the bins overlapping [start, end) of a chromosome
+
+        Returns
+        -------
+        SoN: memmap object
+            read-only scores, without copy
+        '''
+        if chrom not in self._bins:
+            raise ValueError(f'Chromosome {chrom} is not in the store')
+
+        size = self.chromsizes[chrom]
+        end = size if end is None else min(end, size)
+        if start < 0 or start > end:
+            raise ValueError(f'Invalid region {chrom}:{start}-{end}')
+
+        offset, offset_end = self._bins[chrom]
+        n_bins = offset_end - offset
+
+        bin_start = min(start // self.resolution, n_bins)
+        bin_end = min(-(-end // self.resolution), n_bins)
+
+        return self._values[offset + bin_start: offset + bin_end]
+
+    def query(self, region):
+        '''
+        SoN track of a region
+
+        Parameters
+        ----------
+        region: str or tuple object
+            UCSC-style region "chrom:start-end" or "chrom",
+            or (chrom, start, end)
+
+        Returns
+        -------
+        track: DataFrame object
+            bins with columns "chrom", "start", "end" and "SoN",
+            the last bin ends at the size of the chromosome
+        '''
+        chrom, start, end = bioframe.parse_region(region, self.chromsizes.to_dict())
+        SoN = self.fetch(chrom, start, end)
+
+        starts = (start // self.resolution + np.arange(len(SoN))) * self.resolution
+        ends = np.minimum(starts + self.resolution, self.chromsizes[chrom])
+
+        return pd.DataFrame({
+            'chrom': np.repeat(chrom, len(SoN)),
+            'start': starts,
+            'end': ends,
+            'SoN': np.asarray(SoN, dtype=np.float64)
+        })
+
@@ -1,36 +1,25 @@
+import numpy as np
 import pandas as pd
 
 def dataframe_to_bedpe(regions, resolution):
 
-    up_coords_s, down_coords_s = [], []
-    up_coords_e, down_coords_e = [], []
-    chrom_list = []
-    for index, row in regions.iterrows():
-        chrom = row['chrom']
+    chrom_list = regions['chrom'].values
 
-        mid_coord_s = int(row['start'] + row['end']) // 2
+    mid_coord_s = (regions['start'].values + regions['end'].values).astype(int) // 2
+    ext_length = regions['max_extension'].values * 1000
+    if np.isnan(ext_length).any():
+        raise ValueError('nan extension length')
 
-        up_coord_s = int(mid_coord_s - row['max_extension'] * 1000)
-        up_coord_e = int(up_coord_s + resolution)
-
-        down_coord_s = int(mid_coord_s + row['max_extension'] * 1000)
-        down_coord_e = int(down_coord_s + resolution)
-
-        chrom_list.append(chrom)
-
-        up_coords_s.append(up_coord_s)
-        up_coords_e.append(up_coord_e)
-
-        down_coords_s.append(down_coord_s)
-        down_coords_e.append(down_coord_e)
+    up_coords_s = (mid_coord_s - ext_length).astype(int)
+    down_coords_s = (mid_coord_s + ext_length).astype(int)
 
     df = pd.DataFrame(
         {'chr1': chrom_list,
          'x1': up_coords_s,
-         'x2': up_coords_e,
+         'x2': up_coords_s + resolution,
          'chr2': chrom_list,
          'y1': down_coords_s,
-         'y2': down_coords_e}
+         'y2': down_coords_s + resolution}
     )
 
     return df
@@ -38,30 +27,14 @@ def dataframe_to_bedpe(regions, resolution):
 
 def label_sampling_box(regions, resolution, half_width):
 
-    center_upstream_bound_list, center_downstream_bound_list = [], []
-    upstream_upper_bound_list, downstream_lower_bound_list = [], []
-    chrom_list = []
-    for index, row in regions.iterrows():
-
-        center = row['start']
-        chrom = row['chrom']
-
-        center_upstream_bound = center - half_width * resolution
-        center_downstream_bound = center + half_width * resolution
-
-        upstream_upper_bound = center_upstream_bound - 2 * half_width * resolution
-        downstream_lower_bound = center_downstream_bound + 2 * half_width * resolution
+    center = regions['start'].values
+    chrom_list = regions['chrom'].values
 
-        center_upstream_bound_list.append(center_upstream_bound)
-        center_downstream_bound_list.append(center_downstream_bound)
-        upstream_upper_bound_list.append(upstream_upper_bound)
-        downstream_lower_bound_list.append(downstream_lower_bound)
-        chrom_list.append(chrom)
+    center_upstream_bound_list = center - half_width * resolution
+    center_downstream_bound_list = center + half_width * resolution
 
-    center_upstream_bound_list = np.asarray(center_upstream_bound_list)
-    center_downstream_bound_list = np.asarray(center_downstream_bound_list)
-    upstream_upper_bound_list = np.asarray(upstream_upper_bound_list)
-    downstream_lower_bound_list = np.asarray(downstream_lower_bound_list)
+    upstream_upper_bound_list = center_upstream_bound_list - 2 * half_width * resolution
+    downstream_lower_bound_list = center_downstream_bound_list + 2 * half_width * resolution
 
     df_upstream_upper_bound_list = pd.DataFrame(
         {'chr1': chrom_list,
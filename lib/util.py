@@ -1,5 +1,10 @@
+import os
+import glob
+import struct
+import zipfile
 import subprocess
 import bioframe
+import numpy as np
 import pandas as pd
 
 def align_track_with_chromsize(track, chromsizes):
@@ -40,4 +45,180 @@ def bedgraph_to_bigwig(bedGraphToBigWig, track_path, chromsizes_path, bigwig_out
         None
     """
     cmd = [bedGraphToBigWig, track_path, chromsizes_path, bigwig_output_path]
-    subprocess.run(cmd)
\ No newline at end of file
+    subprocess.run(cmd)
+
+
+# length of the fixed part of a local file header of zip
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+def load_npz_mmap(npz_path):
+    """
+    Memory-map the arrays of an uncompressed .npz file (see np.savez),
+    np.load reads the whole arrays of .npz files.
+
+    Args:
+        npz_path (str): Path to the .npz file.
+
+    Returns:
+        Dict of read-only arrays, keyed by name.
+    """
+    arrays = {}
+    with zipfile.ZipFile(npz_path) as zf, open(npz_path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{npz_path} is compressed and can not be memory-mapped')
+
+            # the array follows the local header of its member
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+            name_size, extra_size = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_size + extra_size)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    npz_path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                    order='F' if fortran_order else 'C'
+                )
+
+    return arrays
+
+
+def stale_tmp_files(pattern):
+    """
+    Temporary files left by crashed processes.
+
+    The files are named <path>.<pid>.tmp by the process writing them
+    (see create_cached_band and save_checkpoint), a file is stale when its
+    process no longer exists on this host.
+
+    Args:
+        pattern (str): Glob pattern of the temporary files.
+
+    Returns:
+        List of paths of the stale files.
+    """
+    stale = []
+    for path in glob.glob(pattern):
+        pid = path.rsplit('.', 2)[-2]
+        if pid.isdigit() and not _pid_exists(int(pid)):
+            stale.append(path)
+
+    return stale
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # owned by another user
+        return True
+
+    return True
+
+
+class BigWigWriter(object):
+    """
+    Write signal tracks to a bigWig file (with zoom levels) chromosome by
+    chromosome, without the bedGraph text and bedGraphToBigWig.
+
+    Chromosomes can be added in any order as they complete, each one is
+    written as soon as the chromosomes before it in `chromsizes` are,
+    since bigWig requires sorted entries. Requires pyBigWig.
+
+    Args:
+        path (str): Path to the bigWig file.
+        chromsizes (Series): Chromosome sizes, in the order of the file.
+        max_zooms (int): Maximum number of zoom levels.
+    """
+
+    def __init__(self, path, chromsizes, max_zooms=10):
+        import pyBigWig
+
+        self._bw = pyBigWig.open(path, 'w')
+        self._bw.addHeader(
+            [(chrom, int(size)) for chrom, size in chromsizes.items()],
+            maxZooms=max_zooms
+        )
+        self._order = list(chromsizes.index)
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_track(self, chrom, track):
+        """
+        Add the track of a chromosome.
+
+        Args:
+            chrom (str): Chromosome name, as in `chromsizes`.
+            track (DataFrame): Track with 'start', 'end' and 'value' columns.
+        """
+        self._pending[chrom] = track
+
+        while self._order and self._order[0] in self._pending:
+            chrom = self._order.pop(0)
+            self._write(chrom, self._pending.pop(chrom))
+
+    def close(self):
+        """
+        Write the remaining chromosomes and build the zoom levels.
+
+        """
+        for chrom in self._order:
+            if chrom in self._pending:
+                self._write(chrom, self._pending.pop(chrom))
+
+        self._order = []
+        self._bw.close()
+
+    def _write(self, chrom, track):
+        if len(track) > 0:
+            self._bw.addEntries(
+                [chrom] * len(track),
+                track['start'].values.astype(np.int64),
+                ends=track['end'].values.astype(np.int64),
+                values=track['value'].values.astype(np.float64)
+            )
+
+
+def iter_bigwig_track(bigwig_path):
+    """
+    Read a bigWig file one chromosome at a time.
+
+    Args:
+        bigwig_path (str): Path to the bigWig file.
+
+    Returns:
+        Iterator of (chromosome, DataFrame with 'start', 'end' and 'value'
+        columns), in the order of the file.
+    """
+    import pyBigWig
+
+    bw = pyBigWig.open(bigwig_path)
+    try:
+        for chrom in bw.chroms():
+            intervals = bw.intervals(chrom) or ()
+            intervals = np.asarray(intervals, dtype=np.float64).reshape(-1, 3)
+
+            yield chrom, pd.DataFrame({
+                'start': intervals[:, 0].astype(np.int64),
+                'end': intervals[:, 1].astype(np.int64),
+                'value': intervals[:, 2]
+            })
+    finally:
+        bw.close()
@@ -0,0 +1,105 @@
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.merge_fountains import merge_fountains
+
+FOUNTAIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'Fountain')
+CALL_SETS = sorted(glob.glob(os.path.join(FOUNTAIN_DIR, '*', '*.bedpe')))
+
+
+def pairwise_merge_fountains(regions, max_distance = 50000):
+    '''
+    The per-fountain scan replaced by the sorted sweep, kept as reference
+    '''
+    regions = regions.copy()
+
+    chroms = regions['chrom'].unique()
+    unique_index_list = []
+
+    for chrom in chroms:
+        df = regions[regions['chrom'] == chrom]
+        df_starts = np.asarray(df['start'], dtype = int)
+
+        upstream_bound = df_starts - max_distance
+        downstream_bound = df_starts + max_distance
+
+        for up, down in zip(upstream_bound, downstream_bound):
+            df_overlap = df[
+                (df['start'] >= up) & (df['start'] <= down)
+            ]
+
+            if len(df_overlap) > 1:
+                df_overlap_score = df_overlap['signal_noise_average_background'].values
+                df_overlap_row_index = list(df_overlap.index)
+
+                max_idx = np.argmax(df_overlap_score)
+                df_max_idx = df_overlap.iloc[max_idx].name
+
+                if not df_max_idx in unique_index_list:
+
+                    try:
+                        if unique_index_list[-1] in df_overlap_row_index:
+                            unique_index_list.pop()
+                    except IndexError:
+                        unique_index_list.append(df_overlap.index[0])
+
+                    unique_index_list.append(df_max_idx)
+
+            else:
+                unique_index_list.append(df_overlap.index[0])
+
+    return regions.iloc[unique_index_list]
+
+
+def read_call_set(path):
+    '''
+    Summits of the fountains of a shipped call set
+
+    The anchors of a fountain are symmetric around its summit (see
+    `dataframe_to_bedpe`), the files may keep the git-lfs pointer of an
+    unresolved merge before the table.
+    '''
+    lines = open(path).read().splitlines()
+    if '=======' in lines:
+        lines = lines[lines.index('=======') + 1:]
+    lines = [line for line in lines if not line.startswith('>>>>>>>')]
+
+    bedpe = pd.DataFrame(
+        [line.split('\t')[:6] for line in lines[1:]],
+        columns = lines[0].split('\t')[:6]
+    )
+    resolution = int(re.search(r'_(\d+)kb_', os.path.basename(path)).group(1)) * 1000
+
+    start = (bedpe['x1'].astype(int) + bedpe['y1'].astype(int)) // 2
+    return pd.DataFrame({
+        'chrom': bedpe['chr1'].values,
+        'start': start.values,
+        'end': start.values + resolution,
+    }), resolution
+
+
+def test_call_sets_are_shipped():
+    assert len(CALL_SETS) > 0
+
+
+@pytest.mark.parametrize('path', CALL_SETS, ids=os.path.basename)
+@pytest.mark.parametrize('decimals', [1, 3])
+def test_merge_fountains_matches_pairwise(path, decimals):
+    regions, resolution = read_call_set(path)
+
+    # the call sets keep no score, ties are frequent with one decimal
+    rng = np.random.default_rng(decimals)
+    regions['signal_noise_average_background'] = rng.random(len(regions)).round(decimals)
+    shuffled = regions.sample(frac=1, random_state=decimals).reset_index(drop=True)
+
+    for df in (regions, shuffled):
+        for max_distance in (0, 5 * resolution, 50000, 500000):
+            expected = pairwise_merge_fountains(df, max_distance=max_distance)
+            result = merge_fountains(df, max_distance=max_distance)
+
+            pd.testing.assert_frame_equal(result, expected)